@@ -1,27 +1,1438 @@
 #!/usr/bin/env python3
 # auto_sending_with_config.py
 # 运行前确保: pip install requests
-
-import tkinter as tk
-from tkinter import scrolledtext, messagebox
-import threading, time, random, requests, traceback, json, datetime, os, re, math
+# 图形界面: python auto_sending_with_config.py
+# 无界面:   python auto_sending_with_config.py --headless [--room ID] [--file message.txt] ...
+
+import time
+_T0 = time.perf_counter()  # 冷启动计时起点
+
+import threading, random, traceback, json, datetime, os, re, math, hashlib, tempfile, sys, signal
+import queue, gzip, shutil, atexit, collections, itertools, csv, codecs
+import concurrent.futures, email.utils
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+# tkinter 只在图形界面模式下由 _load_tk() 导入，requests 在第一次创建 Session 时导入，
+# 这样无界面模式和只读操作都不必付出这部分启动开销。
+tk = scrolledtext = messagebox = tkfont = None
+requests = None
+
+def _load_tk():
+    global tk, scrolledtext, messagebox, tkfont
+    import tkinter as tk
+    from tkinter import scrolledtext, messagebox
+    import tkinter.font as tkfont
+
+def _load_requests():
+    global requests
+    if requests is None:
+        import requests
+        import requests.adapters
+    return requests
 
 CONFIG_PATH = "config.json"
+CONFIG_INLINE_MESSAGES_MAX_BYTES = 4096  # 弹幕列表超过该大小时存到单独的文件，config.json 只保存引用
+NAV_URL = "https://api.bilibili.com/x/web-interface/nav"
+SEND_URL = "https://api.live.bilibili.com/msg/send"
+PRECONNECT_URL = "https://api.live.bilibili.com/"  # 验证 Cookie 时顺便与发送主机建立连接
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+HTTP_POOL_CONNECTIONS = 4         # 缓存连接池的主机数
+HTTP_POOL_MAXSIZE = 4             # 每个主机保持的长连接数
+LOGIN_CACHE_TTL = 300.0           # 登录验证结果的缓存时间（秒）
+WORKER_POOL_SIZE = 4              # 网络/文件任务的工作线程数
 LOGFILE = "auto_send_log.txt"
+LOG_MAX_BYTES = 5 * 1024 * 1024   # 日志文件超过该大小后轮转
+LOG_BACKUP_COUNT = 3
+LOG_COMPRESS_BACKUPS = True       # 轮转出的旧日志是否 gzip 压缩
+LOG_FLUSH_INTERVAL = 0.5          # 秒
+LOG_FLUSH_LINES = 200
+LOG_DRAIN_MS = 100                # GUI 批量刷新日志的间隔
+LOG_VIEW_CAPACITY = 5000          # GUI 日志区最多保留的行数
+TELEMETRY_PATH = "send_telemetry.jsonl"  # 以 .csv 结尾时导出为 CSV
+TELEMETRY_WINDOW = 1000           # 延迟分位数基于最近多少次发送
+TELEMETRY_EXPORT_INTERVAL = 10.0  # 秒
+STATUS_REFRESH_MS = 1000
+SEND_JITTER_MAX = 0.5             # 每次发送间隔额外增加的随机抖动上限（秒）
+AUTH_FAIL_HTTP_STATUS = (401, 403)   # 认证问题，立即停止
+RATE_LIMIT_HTTP_STATUS = (412, 429)  # 风控/限流，退避后重试
+RATE_LIMIT_CODES = (10030,)          # code=10030：发送频率过快
+BACKOFF_BASE = 5.0                # 无 Retry-After 时首次退避秒数，之后每次翻倍
+BACKOFF_CAP = 300.0               # 指数退避上限（秒）
+BACKOFF_MAX_CONSECUTIVE = 5       # 连续被限流多少次后停止
+BACKOFF_WIDEN_FACTOR = 1.5        # 每次被限流后发送间隔放大的倍数（本次会话内有效）
+BACKOFF_MAX_INTERVAL_FACTOR = 8.0
+READ_BLOCK_CHARS = 64 * 1024  # 流式读取文件时每块的字符数
+FOLLOW_POLL_INTERVAL = 1.0       # 跟随模式下检查文件追加的间隔（秒）
+FOLLOW_IDLE_FLUSH = 5.0          # 跟随模式下文件停止追加这么久后，未满一块的尾部也发出（秒）
+CHUNK_CACHE_DIR = ".chunk_cache"
+CHUNK_CACHE_MAX_ENTRIES = 8
+CHUNK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+MAX_MESSAGE_LEN = 0               # 单条弹幕长度上限（字符数），超出的不发送；0 表示不限制（房间一般为 20，等级更高时更长）
+CONTENT_REJECT_MESSAGES = ("f", "k")  # code=0 但 message 为 f/k：内容被屏蔽，只有自己可见
+REJECT_CACHE_PATH = "rejected_messages.json"
+REJECT_CACHE_MAX_ENTRIES = 10000
+HISTORY_DB_PATH = "send_history.sqlite3"
+PROFILE_DIR = "profile"           # 性能分析快照的输出目录
+PROFILE_INTERVAL = 60.0           # 秒
+PROFILE_TOP = 30                  # 快照中列出的热点函数/分配位置条数
+PROFILE_TRACE_FRAMES = 5          # tracemalloc 为每次分配保留的调用栈深度
+DRY_RUN_LATENCY = 0.1             # 模拟运行中假定的单次请求耗时（秒）
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# half_count 模式的权重表（以半个计数单位为 1）：ASCII 字母/数字计 1，其他字节计 2
+_HALF_UNIT_WEIGHTS = bytes(1 if chr(b).isalnum() and b < 128 else 2 for b in range(256))
+
+# ----------------- 日志 -----------------
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LOG_LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+class LogWriter:
+    """
+    后台日志写入线程：文件保持打开，按条数或时间批量 flush；
+    超过 max_bytes 后轮转为 .1 .2 ...（compress=True 时压缩为 .gz）。
+    write() 只是入队，不会阻塞调用线程。
+    """
+    _STOP = object()
+
+    def __init__(self, path=LOGFILE, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 compress=LOG_COMPRESS_BACKUPS, flush_interval=LOG_FLUSH_INTERVAL, flush_lines=LOG_FLUSH_LINES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.flush_lines = flush_lines
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def write(self, line):
+        self._queue.put(line)
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+
+    def close(self, timeout=2.0):
+        """把队列中剩余的日志写完并关闭文件"""
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        f = None
+        pending = 0
+        last_flush = time.monotonic()
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            batch = []
+            while item is not None:
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.flush_lines:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            try:
+                if batch:
+                    if f is None:
+                        f = open(self.path, "a", encoding="utf-8")
+                    f.write("\n".join(batch) + "\n")
+                    pending += len(batch)
+                now = time.monotonic()
+                if f is not None and pending and (stop or pending >= self.flush_lines
+                                                  or now - last_flush >= self.flush_interval):
+                    f.flush()
+                    pending = 0
+                    last_flush = now
+                    if self.max_bytes and f.tell() >= self.max_bytes:
+                        f.close()
+                        f = None
+                        self._rotate()
+            except Exception:
+                # 写日志失败不能影响发送，丢弃本批次
+                pending = 0
+        if f is not None:
+            f.close()
+
+    def _rotate(self):
+        ext = ".gz" if self.compress else ""
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}{ext}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i+1}{ext}")
+        if self.backup_count < 1:
+            os.remove(self.path)
+            return
+        first = f"{self.path}.1"
+        os.replace(self.path, first)
+        if self.compress:
+            with open(first, "rb") as src, gzip.open(first + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(first)
+
+class LogBuffer:
+    """
+    固定容量的日志环形缓冲：超出容量时丢弃最旧的行。
+    级别过滤和文本搜索都在缓冲上完成，结果保存在 view 中供列表视图按需取用。
+    """
+    def __init__(self, capacity=LOG_VIEW_CAPACITY):
+        self.entries = collections.deque(maxlen=capacity)
+        self.view = collections.deque(maxlen=capacity)
+        self.min_level = DEBUG
+        self.search = ""
+        self._seq = 0
+
+    def _match(self, entry):
+        return entry[1] >= self.min_level and (not self.search or self.search in entry[2])
+
+    def append(self, level, line):
+        for part in line.split("\n"):
+            self._seq += 1
+            entry = (self._seq, level, part)
+            self.entries.append(entry)
+            if self._match(entry):
+                self.view.append(entry)
+        # 过滤视图里已经被环形缓冲丢弃的行也要移除
+        oldest = self.entries[0][0] if self.entries else self._seq + 1
+        while self.view and self.view[0][0] < oldest:
+            self.view.popleft()
+
+    def set_filter(self, min_level=None, search=None):
+        if min_level is not None:
+            self.min_level = min_level
+        if search is not None:
+            self.search = search
+        self.view = collections.deque((e for e in self.entries if self._match(e)), maxlen=self.entries.maxlen)
+
+    def clear(self):
+        self.entries.clear()
+        self.view.clear()
+
+    def __len__(self):
+        return len(self.view)
+
+    def lines(self, start, stop):
+        return [e[2] for e in itertools.islice(self.view, start, stop)]
+
+LOG_WRITER = LogWriter()
+atexit.register(LOG_WRITER.close)
 
 def log_to_file(s):
-    with open(LOGFILE, "a", encoding="utf-8") as f:
-        f.write(f"{datetime.datetime.now().isoformat()} {s}\n")
+    LOG_WRITER.write(f"{datetime.datetime.now().isoformat()} {s}")
+
+# ----------------- 文本分割 -----------------
+def is_ascii_alnum(ch):
+    """判断字符是否为 ASCII 字母或数字"""
+    # ord范围检查：0-127 and isalnum
+    return ord(ch) < 128 and ch.isalnum()
+
+def normalize_chunk_size(chunk_size, default=20):
+    """防坏输入：非整数或小于 1 时回退到默认值"""
+    try:
+        value = int(chunk_size)
+    except Exception:
+        return default
+    return value if value >= 1 else default
+
+class Chunker:
+    """
+    增量分割器：feed() 接收已去除空白的文本片段，返回其中已经确定的完整分块，
+    未满的尾部留到下一次 feed()；全部喂完后调用 flush() 取出最后一块。
+    分割规则与一次性处理整段文本完全一致。
+    """
+    def __init__(self, chunk_size=20, half_count=False):
+        self.chunk_size = normalize_chunk_size(chunk_size)
+        self.half_count = bool(half_count)
+        self._pending = ""   # 尚未确定的尾部（未满一块）
+
+    def feed(self, text):
+        if not text:
+            return []
+        buf = self._pending + text
+        if not self.half_count:
+            size = self.chunk_size
+            end = len(buf) - len(buf) % size
+            self._pending = buf[end:]
+            return [buf[i:i+size] for i in range(0, end, size)]
+
+        # half_count=True：整块计算每个字符的权重（半单位整数），再在前缀和上二分找切点。
+        # 非 ASCII 字符经 "replace" 编码后都是单个 "?"，保证一个字符对应一个字节。
+        weights = buf.encode("ascii", "replace").translate(_HALF_UNIT_WEIGHTS)
+        cum = list(accumulate(weights))
+        limit = self.chunk_size * 2
+        chunks = []
+        start = 0
+        base = 0
+        n = len(buf)
+        while True:
+            # 当前块能容纳到 end（不含）；每个字符最多 2 个半单位，因此 end > start
+            end = bisect_right(cum, base + limit, start)
+            if end >= n:
+                # 剩余部分未超出上限，要等后续字符才能确定是否结束
+                break
+            chunks.append(buf[start:end])
+            base = cum[end-1]
+            start = end
+        self._pending = buf[start:]
+        return chunks
+
+    def flush(self):
+        tail = self._pending
+        self._pending = ""
+        return [tail] if tail else []
+
+def iter_file_chunks(filename, chunk_size=20, half_count=False, block_chars=READ_BLOCK_CHARS):
+    """
+    按块流式读取 filename（utf-8），逐块移除空白后分割，边读边产出分块。
+    内存中只保留当前读取块和一个未满的分块。
+    """
+    if not os.path.exists(filename):
+        raise FileNotFoundError(f"{filename} 不存在")
+    chunker = Chunker(chunk_size, half_count)
+    with open(filename, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(block_chars)
+            if not block:
+                break
+            yield from chunker.feed(_WHITESPACE_RE.sub("", block))
+    yield from chunker.flush()
+
+# ----------------- 分块索引缓存 -----------------
+def file_fingerprint(filename):
+    """文件指纹：(大小, 修改时间 ns)，任一变化都视为文件已改变"""
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
+
+class ChunkIndex:
+    """
+    磁盘上的分块索引：去除空白后的文本（utf-8）加上每块起始字节偏移数组，
+    第 N 块只需一次 seek + read，不必重新扫描文件。
+    """
+    def __init__(self, text_path, offsets, meta):
+        self.text_path = text_path
+        self.offsets = offsets  # array，长度 = 分块数 + 1
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("chunk index out of range")
+        start = self.offsets[i]
+        with open(self.text_path, "rb") as f:
+            f.seek(start)
+            return f.read(self.offsets[i+1] - start).decode("utf-8")
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def lines(self, start, stop):
+        """第 start 到 stop-1 块，只读取这一段文本"""
+        n = len(self)
+        start, stop = max(0, min(start, n)), max(0, min(stop, n))
+        if start >= stop:
+            return []
+        offsets = self.offsets
+        with open(self.text_path, "rb") as f:
+            f.seek(offsets[start])
+            data = f.read(offsets[stop] - offsets[start])
+        base = offsets[start]
+        return [data[offsets[i] - base:offsets[i+1] - base].decode("utf-8") for i in range(start, stop)]
+
+    def iter_from(self, start):
+        """从第 start 块开始迭代，只需一次 seek"""
+        offsets = self.offsets
+        with open(self.text_path, "rb") as f:
+            f.seek(offsets[min(max(start, 0), len(offsets) - 1)])
+            for i in range(max(start, 0), len(offsets) - 1):
+                yield f.read(offsets[i+1] - offsets[i]).decode("utf-8")
+
+class ChunkIndexCache:
+    """
+    分块索引的磁盘缓存，按 (文件路径, chunk_size, half_count) 存放，
+    命中时再核对文件指纹，文件改动后自动失效；条目数和总大小超限时按 LRU 淘汰。
+    每个条目由 <key>.txt（去空白文本）、<key>.idx（偏移数组）、<key>.json（元数据）组成，
+    .json 最后写入，存在即代表条目完整。
+    """
+    def __init__(self, cache_dir=CHUNK_CACHE_DIR, max_entries=CHUNK_CACHE_MAX_ENTRIES,
+                 max_bytes=CHUNK_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _key(self, filename, chunk_size, half_count):
+        ident = json.dumps([os.path.abspath(filename), int(chunk_size), bool(half_count)])
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".txt", base + ".idx", base + ".json"
+
+    def _remove(self, key):
+        for p in self._paths(key):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def lookup(self, filename, chunk_size=20, half_count=False):
+        """返回有效的 ChunkIndex；未缓存或文件已改变时返回 None"""
+        chunk_size = normalize_chunk_size(chunk_size)
+        key = self._key(filename, chunk_size, half_count)
+        text_path, idx_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if list(file_fingerprint(filename)) != meta.get("fingerprint"):
+            with self._lock:
+                self._remove(key)
+            return None
+        try:
+            offsets = array(meta["typecode"])
+            with open(idx_path, "rb") as f:
+                offsets.frombytes(f.read())
+            os.utime(meta_path)  # 记录最近使用时间，供 LRU 淘汰
+        except (OSError, KeyError, ValueError):
+            with self._lock:
+                self._remove(key)
+            return None
+        return ChunkIndex(text_path, offsets, meta)
+
+    def iter_build(self, filename, chunk_size=20, half_count=False):
+        """
+        流式读取并分割文件，边产出分块边写入索引；完整读完且期间文件未改变才提交缓存，
+        中途停止迭代则丢弃临时文件。
+        """
+        chunk_size = normalize_chunk_size(chunk_size)
+        half_count = bool(half_count)
+        fingerprint = file_fingerprint(filename)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 去空白后的 utf-8 字节数不会超过原文件大小，据此选择偏移数组的宽度
+        typecode = "I" if fingerprint[0] < 2**32 else "Q"
+        offsets = array(typecode, [0])
+        pos = 0
+        fd, tmp_text = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        complete = False
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for c in iter_file_chunks(filename, chunk_size, half_count):
+                    b = c.encode("utf-8")
+                    out.write(b)
+                    pos += len(b)
+                    offsets.append(pos)
+                    yield c
+            complete = True
+        finally:
+            if complete and file_fingerprint(filename) == fingerprint:
+                self._commit(filename, chunk_size, half_count, fingerprint, tmp_text, offsets)
+            else:
+                try:
+                    os.remove(tmp_text)
+                except OSError:
+                    pass
+
+    def _commit(self, filename, chunk_size, half_count, fingerprint, tmp_text, offsets):
+        key = self._key(filename, chunk_size, half_count)
+        text_path, idx_path, meta_path = self._paths(key)
+        meta = {
+            "source": os.path.abspath(filename),
+            "fingerprint": list(fingerprint),
+            "chunk_size": chunk_size,
+            "half_count": half_count,
+            "typecode": offsets.typecode,
+            "count": len(offsets) - 1,
+        }
+        with self._lock:
+            try:
+                self._remove(key)
+                os.replace(tmp_text, text_path)
+                with open(idx_path, "wb") as f:
+                    offsets.tofile(f)
+                with open(meta_path, "w", encoding="utf-8") as f:
+                    json.dump(meta, f, ensure_ascii=False)
+            except OSError:
+                self._remove(key)
+                return
+            self._evict()
+
+    def get_or_build(self, filename, chunk_size=20, half_count=False):
+        """取得文件的分块索引，未命中时完整扫描一次并写入缓存"""
+        index = self.lookup(filename, chunk_size, half_count)
+        if index is not None:
+            return index
+        for _ in self.iter_build(filename, chunk_size, half_count):
+            pass
+        index = self.lookup(filename, chunk_size, half_count)
+        if index is None:
+            raise RuntimeError(f"{filename} 在读取过程中被修改，请重试。")
+        return index
+
+    def _evict(self):
+        """按最近使用时间淘汰超出数量或总大小上限的条目（调用方持有锁）"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            size = 0
+            mtime = 0
+            for p in self._paths(key):
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                size += st.st_size
+                if p.endswith(".json"):
+                    mtime = st.st_mtime
+            entries.append((mtime, key, size))
+        entries.sort(reverse=True)
+        total = 0
+        for i, (_, key, size) in enumerate(entries):
+            total += size
+            if i >= self.max_entries or (total > self.max_bytes and i > 0):
+                self._remove(key)
+
+class FileMessageSource:
+    """
+    文件弹幕源：每次迭代都重新流式读取文件，供 _auto_loop 直接逐条取用，
+    不会事先生成完整的分块列表。给定 cache 时优先走已缓存的分块索引，
+    未命中则在第一轮读取的同时建立索引。
+    """
+    def __init__(self, filename, chunk_size=20, half_count=False, cache=None):
+        self.filename = filename
+        self.chunk_size = normalize_chunk_size(chunk_size)
+        self.half_count = bool(half_count)
+        self.cache = cache
+
+    def __iter__(self):
+        if self.cache is None:
+            return iter_file_chunks(self.filename, self.chunk_size, self.half_count)
+        if not os.path.exists(self.filename):
+            raise FileNotFoundError(f"{self.filename} 不存在")
+        index = self.cache.lookup(self.filename, self.chunk_size, self.half_count)
+        if index is not None:
+            return iter(index)
+        return self.cache.iter_build(self.filename, self.chunk_size, self.half_count)
+
+    def iter_from(self, start):
+        """从第 start 块开始迭代：有缓存时直接 seek 到该块，否则只能从头读过去"""
+        if self.cache is not None:
+            return self.as_sequence().iter_from(start)
+        return itertools.islice(iter(self), start, None)
+
+    def history_key(self):
+        """发送历史中标识该弹幕源的字段：文件内容（指纹）或分割参数变了就是另一个源"""
+        return ["file", os.path.abspath(self.filename), list(file_fingerprint(self.filename)),
+                self.chunk_size, self.half_count]
+
+    def as_sequence(self):
+        """返回支持随机访问的分块序列：有缓存时为 ChunkIndex，否则展开为列表"""
+        if self.cache is not None:
+            return self.cache.get_or_build(self.filename, self.chunk_size, self.half_count)
+        return list(self)
+
+    def first(self):
+        """只读取到第一条分块为止；文件为空时返回 None"""
+        it = iter(self)
+        try:
+            return next(it, None)
+        finally:
+            it.close()
+
+class FollowingFileSource:
+    """
+    跟随模式的文件弹幕源（类似 tail -f）：记住已读到的字节偏移、utf-8 增量解码器和 Chunker 的未满尾部，
+    文件有追加时只读取并分割新增的字节，接在已产出的分块后面，不重新扫描整个文件。
+    标准库没有跨平台的文件变更通知，这里按 poll_interval 比较大小和修改时间，没有变化时每次只有一个 stat。
+    文件被替换（inode 改变）、被截断或已读部分的末尾被改写时，丢弃已有状态从头读取。
+    追加停止超过 idle_flush 秒后，未满一块的尾部也作为一条产出。
+    续传游标保存 checkpoint()：已读取的字节偏移、未解码的字节和已读出但还没发出的文本，
+    而不是分块序号，因为追加后尾部会与新内容拼成不同的分块。
+    """
+    SIGNATURE_BYTES = 64  # 记住已读部分的最后若干字节，用来发现原地改写
+
+    def __init__(self, filename, chunk_size=20, half_count=False, poll_interval=FOLLOW_POLL_INTERVAL,
+                 idle_flush=FOLLOW_IDLE_FLUSH, block_bytes=READ_BLOCK_CHARS, clock=time.monotonic):
+        self.filename = filename
+        self.chunk_size = normalize_chunk_size(chunk_size)
+        self.half_count = bool(half_count)
+        self.poll_interval = poll_interval
+        self.idle_flush = idle_flush
+        self.block_bytes = block_bytes
+        self.clock = clock
+        self.resets = 0
+        self._restart()
+
+    def _restart(self):
+        self.offset = 0      # 已读取的字节数
+        self.emitted = 0     # 已产出（含续传前）的分块数
+        self._queue = collections.deque()  # 已分割出但还没产出的分块
+        self._ident = None   # (st_dev, st_ino)
+        self._seen = None    # 上次读到末尾时的 (大小, 修改时间)
+        self._sig = b""
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._chunker = Chunker(self.chunk_size, self.half_count)
+        self._last_growth = self.clock()
+
+    def _reset(self, reason, log=None):
+        if log is not None:
+            log(f"{self.filename} {reason}，从头重新读取。", level=WARNING)
+        self._restart()
+        self.resets += 1
+
+    def history_key(self):
+        """按路径和文件身份标识：追加不改变续传游标，换了一个文件则重新开始"""
+        try:
+            st = os.stat(self.filename)
+            ident = [st.st_dev, st.st_ino]
+        except OSError:
+            ident = None
+        return ["follow", os.path.abspath(self.filename), ident, self.chunk_size, self.half_count]
+
+    def poll(self, log=None):
+        """
+        检查一次文件并最多读取 block_bytes 字节，返回其中新确定的分块；
+        没有读到新内容时返回 None（此时若已空闲够久，返回冲刷出的尾部）。
+        """
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return None  # 可能正被编辑器替换，下次再看
+        ident = (st.st_dev, st.st_ino)
+        if self._ident is not None and ident != self._ident:
+            self._reset("已被替换", log)
+        elif st.st_size < self.offset:
+            self._reset("已被截断", log)
+        seen = (st.st_size, st.st_mtime_ns)
+        if seen != self._seen or self.offset < st.st_size:
+            data = self._read(log)
+            if data:
+                self._ident = ident
+                self._last_growth = self.clock()
+                text = self._decoder.decode(data)
+                return self._chunker.feed(_WHITESPACE_RE.sub("", text))
+            self._ident = ident
+            self._seen = seen
+        if self._chunker._pending and self.clock() - self._last_growth >= self.idle_flush:
+            return self._chunker.flush()
+        return None
+
+    def _read(self, log=None):
+        sig = self._sig
+        with open(self.filename, "rb") as f:
+            f.seek(self.offset - len(sig))
+            if f.read(len(sig)) != sig:
+                self._reset("已被改写", log)
+                f.seek(0)
+            data = f.read(self.block_bytes)
+        self.offset += len(data)
+        self._sig = (self._sig + data)[-self.SIGNATURE_BYTES:]
+        return data
+
+    def checkpoint(self):
+        """最后产出的分块之后的读取状态（可 JSON 序列化），续传时交给 follow(resume=...)"""
+        return {"offset": self.offset, "sig": self._sig.hex(), "undecoded": self._decoder.getstate()[0].hex(),
+                "tail": "".join(self._queue) + self._chunker._pending, "emitted": self.emitted}
+
+    def _resume(self, state, log=None):
+        offset = state["offset"]
+        sig = bytes.fromhex(state["sig"])
+        try:
+            with open(self.filename, "rb") as f:
+                f.seek(offset - len(sig))
+                same = f.read(len(sig)) == sig
+        except OSError:
+            same = False
+        if not same:
+            if log is not None:
+                log(f"{self.filename} 与上次记录的位置对不上，从头读取。", level=WARNING)
+            return
+        self.offset = offset
+        self._sig = sig
+        self._decoder.setstate((bytes.fromhex(state["undecoded"]), 0))
+        self.emitted = state["emitted"]
+        # 尾部从分块边界开始，重新喂给 Chunker 得到的分块与上次一致
+        self._queue.extend(self._chunker.feed(state["tail"]))
+
+    def follow(self, should_continue, sleep=time.sleep, resume=None, log=None):
+        """
+        逐条产出分块，读到文件末尾后每 poll_interval 秒检查一次追加，直到 should_continue() 为假。
+        resume 为上次保存的 checkpoint()，从那里接着读；文件已对不上时从头读取。
+        """
+        if resume:
+            self._resume(resume, log)
+        waited_at = None
+        while should_continue():
+            if not self._queue:
+                chunks = self.poll(log)
+                if chunks is None:
+                    if waited_at != (self.resets, self.offset) and log is not None:
+                        log(f"已读到 {self.filename} 末尾（{self.offset} 字节），等待追加...")
+                    waited_at = (self.resets, self.offset)
+                    sleep(self.poll_interval)
+                    continue
+                self._queue.extend(chunks)
+            while self._queue:
+                if not should_continue():
+                    return
+                c = self._queue.popleft()
+                self.emitted += 1
+                yield c
+
+# ----------------- 发送统计 -----------------
+class SendTelemetry:
+    """
+    每次发送生成一条结构化记录（单调时钟时间戳、延迟及其中建连/服务器各占多少、是否新建连接、
+    HTTP 状态、B 站 code、消息长度），内存中维护滚动计数、首条延迟和最近 window 条（复用连接）的延迟分位数，
+    并定期把新记录追加导出到 path（.csv 结尾导出 CSV，否则为 JSONL；已有 CSV 的列不同时先改名为 .old）。
+    """
+    FIELDS = ("ts", "t_start", "latency_ms", "connect_ms", "server_ms", "new_conn", "http_status", "code", "ok", "msg_len", "error")
+
+    def __init__(self, path=TELEMETRY_PATH, window=TELEMETRY_WINDOW, export_interval=TELEMETRY_EXPORT_INTERVAL):
+        self.path = path
+        self.export_interval = export_interval
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._steady_latencies = collections.deque(maxlen=window)  # 复用已有连接的发送
+        self.first_latency = None
+        self.last_record = None
+        self._starts = collections.deque(maxlen=window)
+        self._pending = []
+        self._last_export = time.monotonic()
+        self.total = 0
+        self.ok = 0
+        self.codes = collections.Counter()
+        self.statuses = collections.Counter()
+
+    def record(self, t_start, latency, msg_len, http_status=None, code=None, ok=False,
+               connect_time=None, new_conn=None, error=None):
+        """connect_time 为本次发送中建立连接的耗时，其余部分（发请求、服务器处理、读响应）记为 server_ms"""
+        rec = {
+            "ts": round(time.time(), 3),
+            "t_start": round(t_start, 6),
+            "latency_ms": round(latency * 1000, 2),
+            "connect_ms": round(connect_time * 1000, 2) if connect_time is not None else None,
+            "server_ms": round((latency - connect_time) * 1000, 2) if connect_time is not None and error is None else None,
+            "new_conn": new_conn,
+            "http_status": http_status,
+            "code": code,
+            "ok": bool(ok),
+            "msg_len": msg_len,
+            "error": error,
+        }
+        with self._lock:
+            self.total += 1
+            if ok:
+                self.ok += 1
+            self.codes[code] += 1
+            self.statuses[http_status] += 1
+            self._latencies.append(latency)
+            if self.first_latency is None:
+                self.first_latency = latency
+            elif new_conn is False:
+                self._steady_latencies.append(latency)
+            self._starts.append(t_start)
+            self._pending.append(rec)
+            self.last_record = rec
+            due = time.monotonic() - self._last_export >= self.export_interval
+        if due:
+            self.export()
+        return rec
+
+    def new_session(self):
+        """新一轮自动发送开始：重新记录首条延迟"""
+        with self._lock:
+            self.first_latency = None
+
+    def percentiles(self, points=(50, 90, 99), steady=False):
+        """最近 window 条发送的延迟分位数（毫秒）；steady=True 时只统计复用连接的发送"""
+        with self._lock:
+            data = sorted(self._steady_latencies if steady else self._latencies)
+        if not data:
+            return {p: None for p in points}
+        return {p: round(data[min(len(data) - 1, int(len(data) * p / 100))] * 1000, 1) for p in points}
+
+    def rate_per_min(self, now=None):
+        """最近 60 秒内实际发出的条数"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return sum(1 for t in self._starts if now - t <= 60.0)
+
+    def summary(self):
+        with self._lock:
+            total, ok = self.total, self.ok
+            codes = dict(self.codes)
+            statuses = dict(self.statuses)
+        return {
+            "total": total,
+            "ok": ok,
+            "failed": total - ok,
+            "rate_per_min": self.rate_per_min(),
+            "latency_ms": self.percentiles(),
+            "first_latency_ms": round(self.first_latency * 1000, 1) if self.first_latency is not None else None,
+            "steady_latency_ms": self.percentiles(steady=True),
+            "codes": codes,
+            "http_status": statuses,
+        }
+
+    def status_text(self):
+        s = self.summary()
+        lat = {p: "-" if v is None else v for p, v in s["latency_ms"].items()}
+        text = (f"已发送 {s['total']}（成功 {s['ok']} / 失败 {s['failed']}）  "
+                f"速率 {s['rate_per_min']}/分钟  延迟 p50={lat[50]} p90={lat[90]} p99={lat[99]} ms")
+        if s["first_latency_ms"] is not None:
+            text += f"（首条 {s['first_latency_ms']} ms，稳态 p50={s['steady_latency_ms'][50] or '-'} ms）"
+        errors = {k: v for k, v in s["codes"].items() if k not in (0, None)}
+        if errors:
+            text += "  错误码 " + ", ".join(f"{k}×{v}" for k, v in sorted(errors.items(), key=lambda kv: -kv[1])[:3])
+        return text
+
+    def export(self):
+        """把尚未导出的记录追加写入文件"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_export = time.monotonic()
+        if not pending or not self.path:
+            return
+        try:
+            if self.path.endswith(".csv"):
+                if os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8", newline="") as f:
+                        header = f.readline().strip()
+                    if header != ",".join(self.FIELDS):
+                        os.replace(self.path, self.path + ".old")
+                new_file = not os.path.exists(self.path)
+                with open(self.path, "a", encoding="utf-8", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                    if new_file:
+                        writer.writeheader()
+                    writer.writerows(pending)
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in pending))
+        except OSError:
+            pass
+
+# ----------------- 发送前检查 -----------------
+def message_length(text, half_count=False):
+    """按与分割相同的计数方式计算弹幕长度：half_count 时 ASCII 字母/数字算 0.5"""
+    if not half_count:
+        return len(text)
+    return sum(0.5 if is_ascii_alnum(ch) else 1 for ch in text)
+
+def message_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class RejectionCache:
+    """
+    被服务器按内容拒绝过的弹幕（只存 sha1），持久化到 JSON 文件，之后的运行直接跳过。
+    第一次使用时才读取文件；超过 max_entries 时丢弃最早加入的。path 为 None 时只保存在内存中。
+    """
+    def __init__(self, path=REJECT_CACHE_PATH, max_entries=REJECT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._hashes = None  # OrderedDict，按加入顺序
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._hashes is None:
+            hashes = collections.OrderedDict()
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        for h in json.load(f).get("hashes", []):
+                            hashes[h] = None
+                except (OSError, ValueError, AttributeError):
+                    pass
+            self._hashes = hashes
+        return self._hashes
+
+    def __contains__(self, text):
+        with self._lock:
+            return message_hash(text) in self._load()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+    def add(self, text):
+        with self._lock:
+            hashes = self._load()
+            hashes[message_hash(text)] = None
+            while len(hashes) > self.max_entries:
+                hashes.popitem(last=False)
+            self._save(hashes)
+
+    def clear(self):
+        with self._lock:
+            self._hashes = collections.OrderedDict()
+            self._save(self._hashes)
+
+    def _save(self, hashes):
+        if not self.path:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"hashes": list(hashes)}, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+class Preflight:
+    """
+    发送前检查：空弹幕、超过长度上限、本轮已发过的重复弹幕、曾被服务器按内容拒绝的弹幕
+    直接跳过，不发请求也不占用发送间隔。按原因统计跳过的条数，即省下的请求数。
+    """
+    REASONS = {"empty": "空弹幕", "too_long": "超长", "duplicate": "重复", "rejected": "曾被拒绝"}
+
+    def __init__(self, max_len=MAX_MESSAGE_LEN, half_count=False, rejected=None):
+        self.max_len = max_len
+        self.half_count = half_count  # 长度按与分割相同的方式计数
+        self.rejected = rejected if rejected is not None else RejectionCache()
+        self.skipped = collections.Counter()
+        self.examples = collections.deque(maxlen=50)  # 最近被跳过的 (原因, 弹幕)
+        self._seen = set()
+
+    def reset(self):
+        self.skipped.clear()
+        self.examples.clear()
+        self._seen.clear()
+
+    def begin_pass(self):
+        """新一轮循环开始：上一轮发过的弹幕不再算重复"""
+        self._seen.clear()
+
+    def check(self, msg, duplicates=True):
+        """返回跳过原因（REASONS 的键），可以发送时返回 None 并记下该弹幕"""
+        if not msg or not msg.strip():
+            reason = "empty"
+        elif self.max_len and message_length(msg, self.half_count) > self.max_len:
+            reason = "too_long"
+        elif duplicates and hash(msg) in self._seen:
+            reason = "duplicate"
+        elif msg in self.rejected:
+            reason = "rejected"
+        else:
+            if duplicates:
+                self._seen.add(hash(msg))
+            return None
+        self.skipped[reason] += 1
+        self.examples.append((reason, msg))
+        return reason
+
+    @property
+    def saved(self):
+        return sum(self.skipped.values())
+
+    def status_text(self):
+        if not self.saved:
+            return ""
+        detail = " / ".join(f"{self.REASONS[k]} {v}" for k, v in self.skipped.most_common())
+        return f"预检跳过 {self.saved} 条，省下 {self.saved} 次请求（{detail}）"
+
+# ----------------- 发送调度 -----------------
+class VirtualClock:
+    """虚拟时钟：sleep() 只把时间往前拨，不真正等待；用于模拟运行"""
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+class SendPacer:
+    """
+    基于单调时钟的截止时间调度：相邻两次发送的开始时刻至少相隔 interval，
+    再加上 [0, jitter) 的随机抖动。截止时间从上一次实际开始发送的时刻算起，
+    请求本身的耗时不会累加进周期。同时记录实测间隔，用于核对节奏。
+    clock/sleep 可替换，便于测试。
+    """
+    def __init__(self, interval=2.0, jitter=SEND_JITTER_MAX, clock=time.monotonic, sleep=time.sleep,
+                 poll=0.1, window=TELEMETRY_WINDOW):
+        self.interval = interval
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self.poll = poll  # 等待时检查取消的最长间隔
+        self._last_start = None
+        self._next_gap = interval
+        self._hold_until = None
+        self._gaps = collections.deque(maxlen=window)
+
+    def set_interval(self, interval):
+        self.interval = max(0.1, float(interval)) if interval else 2.0
+        self._next_gap = self.interval + random.uniform(0, self.jitter)
+
+    def reset_stats(self):
+        self._gaps.clear()
+
+    def hold(self, seconds):
+        """退避：seconds 秒内不再发送"""
+        self._hold_until = self.clock() + seconds
+
+    def wait(self, should_continue=None):
+        """阻塞到下一个允许发送的时刻；等待期间 should_continue() 为假则返回 False"""
+        deadline = self._last_start + self._next_gap if self._last_start is not None else None
+        if self._hold_until is not None:
+            deadline = self._hold_until if deadline is None else max(deadline, self._hold_until)
+        if deadline is None:
+            return True
+        while True:
+            if should_continue is not None and not should_continue():
+                return False
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                return True
+            self.sleep(min(remaining, self.poll))
+
+    def mark_sent(self):
+        """在真正发出请求前调用，记录本次开始时刻并抽取下一次的抖动"""
+        now = self.clock()
+        if self._last_start is not None:
+            # 同时记下当时生效的间隔，间隔在会话中可能被调整
+            self._gaps.append((now - self._last_start, self.interval))
+        self._last_start = now
+        self._next_gap = self.interval + random.uniform(0, self.jitter)
+
+    def stats(self):
+        """实测发送间隔统计（秒）；below_interval 为短于配置间隔的次数，正常应为 0"""
+        gaps = sorted(g for g, _ in self._gaps)
+        if not gaps:
+            return {"count": 0, "interval": self.interval}
+        return {
+            "count": len(gaps),
+            "interval": self.interval,
+            "min": round(gaps[0], 3),
+            "mean": round(sum(gaps) / len(gaps), 3),
+            "p50": round(gaps[len(gaps) // 2], 3),
+            "max": round(gaps[-1], 3),
+            "below_interval": sum(1 for g, interval in self._gaps if g < interval - 0.01),
+        }
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+class RateLimitBackoff:
+    """
+    限流退避控制器：遇到 412/429（或 code=10030 发送过快）时优先遵守 Retry-After，
+    否则按指数退避（有上限）暂停，并把本次会话的发送间隔放宽 widen 倍；
+    连续被限流达到 max_consecutive 次才停止。发送成功后连续计数清零。
+    """
+    def __init__(self, base=BACKOFF_BASE, cap=BACKOFF_CAP, max_consecutive=BACKOFF_MAX_CONSECUTIVE,
+                 widen=BACKOFF_WIDEN_FACTOR, max_factor=BACKOFF_MAX_INTERVAL_FACTOR):
+        self.base = base
+        self.cap = cap
+        self.max_consecutive = max_consecutive
+        self.widen = widen
+        self.max_factor = max_factor
+        self.reset()
+
+    def reset(self):
+        self.consecutive = 0
+        self.total_limited = 0
+        self.interval_factor = 1.0
+        self.last_delay = None
+        self.resume_at = None  # time.monotonic() 时刻
+
+    @staticmethod
+    def is_limited(res):
+        return res.get("http_status") in RATE_LIMIT_HTTP_STATUS or res.get("code") in RATE_LIMIT_CODES
+
+    def on_limited(self, retry_after=None):
+        """记录一次限流，返回应暂停的秒数；超过连续次数上限时返回 None 表示应停止"""
+        self.consecutive += 1
+        self.total_limited += 1
+        if self.consecutive >= self.max_consecutive:
+            return None
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = min(self.cap, self.base * 2 ** (self.consecutive - 1))
+            delay *= random.uniform(1.0, 1.2)
+        self.interval_factor = min(self.max_factor, self.interval_factor * self.widen)
+        self.last_delay = delay
+        self.resume_at = time.monotonic() + delay
+        return delay
+
+    def on_success(self):
+        self.consecutive = 0
+        self.resume_at = None
+
+    def status_text(self):
+        if not self.total_limited:
+            return ""
+        text = f"限流 {self.total_limited} 次（连续 {self.consecutive}/{self.max_consecutive}），间隔×{self.interval_factor:.2f}"
+        if self.resume_at is not None:
+            remaining = self.resume_at - time.monotonic()
+            if remaining > 0:
+                text += f"，退避中 剩余 {remaining:.0f}s"
+        return text
+
+class SendQueue:
+    """
+    所有发送（自动循环和单次测试）共用的串行队列：唯一的工作线程按 SendPacer
+    的节奏逐条调用 send_single，submit() 返回 Future。
+    """
+    def __init__(self, send, pacer):
+        self.send = send
+        self.pacer = pacer
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, roomid, text, should_continue=None):
+        """should_continue() 为假时，尚在排队等待的任务会以 cancelled 结果结束"""
+        fut = concurrent.futures.Future()
+        self._queue.put((fut, roomid, text, should_continue))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="send-queue", daemon=True)
+                self._thread.start()
+        return fut
+
+    def _execute(self, roomid, text, should_continue):
+        if not self.pacer.wait(should_continue):
+            return {"ok": False, "cancelled": True, "error": "已取消"}
+        self.pacer.mark_sent()
+        return self.send(roomid, text)
+
+    def _run(self):
+        while True:
+            fut, roomid, text, should_continue = self._queue.get()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(self._execute(roomid, text, should_continue))
+            except Exception as e:
+                fut.set_exception(e)
+
+class InlineSendQueue(SendQueue):
+    """在调用线程中直接按节奏执行的发送队列，返回已完成的 Future；用于模拟运行"""
+    def submit(self, roomid, text, should_continue=None):
+        fut = concurrent.futures.Future()
+        try:
+            fut.set_result(self._execute(roomid, text, should_continue))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+# ----------------- 发送历史 -----------------
+def iter_messages_from(messages, start):
+    """从第 start 条开始迭代弹幕源；ChunkIndex/FileMessageSource 直接定位，列表按下标取"""
+    if start <= 0:
+        return iter(messages)
+    if hasattr(messages, "iter_from"):
+        return messages.iter_from(start)
+    if hasattr(messages, "__getitem__"):
+        return (messages[i] for i in range(start, len(messages)))
+    return itertools.islice(iter(messages), start, None)
+
+class SendHistory:
+    """
+    SQLite 发送历史：每次发送尝试一行（弹幕序号、哈希、时间、结果、延迟），
+    并按 (弹幕源, 房间) 保存续传游标，即最后一条确认送达的弹幕的下一条序号；
+    跟随模式的弹幕源还在 state 中保存读取状态（见 FollowingFileSource.checkpoint）。
+    记录尝试和推进游标在同一个事务里完成，进程中途退出也不会不一致。
+    第一次使用时才打开数据库；path 为 None 时不记录。
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY,
+        source_key TEXT NOT NULL,
+        source TEXT,
+        roomid TEXT,
+        started REAL NOT NULL,
+        ended REAL
+    );
+    CREATE TABLE IF NOT EXISTS attempts (
+        id INTEGER PRIMARY KEY,
+        session_id INTEGER NOT NULL,
+        source_key TEXT NOT NULL,
+        msg_index INTEGER,
+        msg_hash TEXT NOT NULL,
+        ts REAL NOT NULL,
+        outcome TEXT NOT NULL,
+        http_status INTEGER,
+        code INTEGER,
+        latency_ms REAL
+    );
+    CREATE INDEX IF NOT EXISTS attempts_source_index ON attempts (source_key, msg_index);
+    CREATE INDEX IF NOT EXISTS attempts_session ON attempts (session_id);
+    CREATE TABLE IF NOT EXISTS cursors (
+        source_key TEXT PRIMARY KEY,
+        next_index INTEGER NOT NULL,
+        updated REAL NOT NULL,
+        state TEXT
+    );
+    """
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            if "state" not in [r[1] for r in conn.execute("PRAGMA table_info(cursors)")]:
+                conn.execute("ALTER TABLE cursors ADD COLUMN state TEXT")  # 旧版本建的库
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @staticmethod
+    def source_key(messages, roomid):
+        """(弹幕源, 房间) 的标识：文件按路径+指纹+分割参数，列表按内容"""
+        if hasattr(messages, "history_key"):
+            ident = messages.history_key()
+        else:
+            ident = ["list", hashlib.sha1("\n".join(messages).encode("utf-8")).hexdigest()]
+        ident.append(str(roomid))
+        return hashlib.sha1(json.dumps(ident, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def cursor(self, source_key):
+        """续传位置（下一条要发送的序号），没有记录时为 0"""
+        if not self.path:
+            return 0
+        with self._lock:
+            row = self._db().execute("SELECT next_index FROM cursors WHERE source_key = ?", (source_key,)).fetchone()
+        return row[0] if row else 0
+
+    def cursor_state(self, source_key):
+        """游标附带的读取状态，没有时为 None"""
+        if not self.path:
+            return None
+        with self._lock:
+            row = self._db().execute("SELECT state FROM cursors WHERE source_key = ?", (source_key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def reset_cursor(self, source_key):
+        if not self.path:
+            return
+        with self._lock, self._db() as db:
+            db.execute("DELETE FROM cursors WHERE source_key = ?", (source_key,))
+
+    def begin_session(self, source_key, source, roomid):
+        if not self.path:
+            return None
+        with self._lock, self._db() as db:
+            return db.execute("INSERT INTO sessions (source_key, source, roomid, started) VALUES (?, ?, ?, ?)",
+                              (source_key, source, str(roomid), time.time())).lastrowid
+
+    def end_session(self, session_id):
+        if not self.path or session_id is None:
+            return
+        with self._lock, self._db() as db:
+            db.execute("UPDATE sessions SET ended = ? WHERE id = ?", (time.time(), session_id))
+
+    def record(self, session_id, source_key, msg_index, msg, outcome, http_status=None, code=None,
+               latency_ms=None, advance=False, state=None):
+        """记录一次发送尝试；advance=True 时把游标推进到 msg_index + 1，并保存读取状态 state"""
+        if not self.path or session_id is None:
+            return
+        now = time.time()
+        with self._lock, self._db() as db:
+            db.execute("INSERT INTO attempts (session_id, source_key, msg_index, msg_hash, ts, outcome, http_status, code, latency_ms)"
+                       " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (session_id, source_key, msg_index, message_hash(msg), now, outcome, http_status,
+                        code if isinstance(code, int) else None, latency_ms))
+            if advance and msg_index is not None:
+                db.execute("INSERT OR REPLACE INTO cursors (source_key, next_index, updated, state) VALUES (?, ?, ?, ?)",
+                           (source_key, msg_index + 1, now, json.dumps(state, ensure_ascii=False) if state else None))
+
+    def sessions(self, limit=20):
+        """最近的会话及其发送统计，新的在前"""
+        if not self.path or not os.path.exists(self.path):
+            return []
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT s.id, s.started, s.ended, s.roomid, s.source, COUNT(a.id),"
+                " SUM(a.outcome = 'ok'), (SELECT msg_index FROM attempts WHERE session_id = s.id AND outcome = 'ok'"
+                " ORDER BY id DESC LIMIT 1), AVG(a.latency_ms)"
+                " FROM sessions s LEFT JOIN attempts a ON a.session_id = s.id"
+                " GROUP BY s.id ORDER BY s.id DESC LIMIT ?", (limit,)).fetchall()
+        keys = ("id", "started", "ended", "roomid", "source", "attempts", "ok", "last_ok_index", "avg_latency_ms")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def attempts(self, session_id):
+        if not self.path or not os.path.exists(self.path):
+            return []
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT msg_index, msg_hash, ts, outcome, http_status, code, latency_ms FROM attempts"
+                " WHERE session_id = ? ORDER BY id", (session_id,)).fetchall()
+        keys = ("msg_index", "msg_hash", "ts", "outcome", "http_status", "code", "latency_ms")
+        return [dict(zip(keys, r)) for r in rows]
+
+# ----------------- 并发 -----------------
+class UiEventBus:
+    """
+    后台线程与 Tk 主线程之间的事件队列：任何线程都可以 emit()/call()，
+    主线程定时调用 drain() 依次执行，回调里可以放心操作控件。
+    """
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._handlers = collections.defaultdict(list)
+
+    def on(self, name, handler):
+        self._handlers[name].append(handler)
+
+    def emit(self, name, *args):
+        self._queue.put((name, args))
+
+    def call(self, fn, *args):
+        """在主线程执行 fn(*args)"""
+        self._queue.put((fn, args))
+
+    def drain(self, on_error=None):
+        while True:
+            try:
+                target, args = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            handlers = [target] if callable(target) else self._handlers.get(target, ())
+            for handler in handlers:
+                try:
+                    handler(*args)
+                except Exception as e:
+                    if on_error is not None:
+                        on_error(e)
+
+class WorkerPool:
+    """
+    有界工作线程池，用于网络请求和文件处理；run() 立即返回，
+    完成后的 on_done(result) / on_error(exc) 通过 UiEventBus 回到主线程执行。
+    """
+    def __init__(self, bus=None, max_workers=WORKER_POOL_SIZE):
+        self.bus = bus
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="worker")
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def run(self, fn, *args, on_done=None, on_error=None):
+        fut = self.executor.submit(fn, *args)
+
+        def deliver(f):
+            exc = f.exception()
+            if exc is not None:
+                if on_error is not None:
+                    self.bus.call(on_error, exc)
+            elif on_done is not None:
+                self.bus.call(on_done, f.result())
+        if on_done is not None or on_error is not None:
+            fut.add_done_callback(deliver)
+        return fut
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+# ----------------- HTTP 传输 -----------------
+_connect_timing = threading.local()  # 当前线程本次请求中新建连接的个数和建连（DNS/TCP/TLS）累计耗费的秒数
+
+def _timed_pool_class(pool_cls):
+    """
+    连接池子类：其连接的 connect() 计数并计时，累加到 _connect_timing。
+    只有新建连接时才会调用 connect()，据此判断本次发送是否复用了连接，并把延迟拆成建连和服务器两部分。
+    """
+    class TimedConnection(pool_cls.ConnectionCls):
+        def connect(self):
+            t0 = time.monotonic()
+            try:
+                super().connect()
+            finally:
+                _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.monotonic() - t0
+                _connect_timing.count = getattr(_connect_timing, "count", 0) + 1
+    return type("Timed" + pool_cls.__name__, (pool_cls,), {"ConnectionCls": TimedConnection})
+
+def make_session():
+    """
+    创建发送用的 Session：显式挂载带连接池的 HTTPAdapter（每个主机保持若干长连接，
+    不做自动重试，重试由退避控制器负责），公共请求头只设置一次。
+    """
+    _load_requests()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                                            pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+    adapter.poolmanager.pool_classes_by_scheme = {
+        scheme: _timed_pool_class(cls) for scheme, cls in adapter.poolmanager.pool_classes_by_scheme.items()}
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT, "Connection": "keep-alive"})
+    return session
 
 class DanmakuSender:
-    def __init__(self, gui_log):
-        self.session = requests.Session()
+    def __init__(self, gui_log=None, log_level=INFO, executor=None, on_stopped=None, offline=False):
+        """offline=True 供模拟运行使用：不创建 Session，不写日志文件、遥测和发送历史，也不注册退出时的导出"""
+        self.session = None if offline else make_session()
         self.cookie_dict = {}
         self.bili_jct = None
         self.sessdata = None
         self.running = threading.Event()
         self.thread = None
-        self.gui_log = gui_log
+        self.gui_log = gui_log  # 线程安全的回调 gui_log(level, line)，由 GUI 在主线程批量显示
+        self.log_level = log_level
+        self.executor = executor      # 提供 submit() 的线程池；为 None 时临时开线程
+        self.on_stopped = on_stopped  # 自动发送线程真正退出后调用（在发送线程中）
+        self.log_to_file = not offline
+        self.telemetry = SendTelemetry(path=None if offline else TELEMETRY_PATH)
+        if not offline:
+            atexit.register(self.telemetry.export)
+        self.pacer = SendPacer()
+        self.send_queue = SendQueue(self.send_single, self.pacer)
+        self.backoff = RateLimitBackoff()
+        self.preflight = Preflight()
+        self.history = SendHistory(None if offline else HISTORY_DB_PATH)
+        self._send_headers = {}  # roomid -> 请求头，每个房间只构造一次
+        self._send_form = {}     # 除 msg/rnd 外固定不变的表单字段
+        self._login_cache = {}   # 凭据哈希 -> (过期时刻, 验证结果)，只缓存验证通过的结果
 
     # ---------------- cookie 管理 ----------------
     def parse_cookie_string(self, cookie_str):
@@ -38,6 +1449,7 @@ class DanmakuSender:
 
     def update_cookie(self, cookie_str):
         d = self.parse_cookie_string(cookie_str)
+        old_key = self._credential_key()
         self.cookie_dict = d
         self.bili_jct = d.get("bili_jct") or d.get("bili_jct ")
         self.sessdata = d.get("SESSDATA") or d.get("SESSDATA ")
@@ -45,6 +1457,9 @@ class DanmakuSender:
         self.session.cookies.clear()
         for k, v in d.items():
             self.session.cookies.set(k, v)
+        self._send_form = {}
+        if self._credential_key() != old_key:
+            self._login_cache.clear()
         return d
 
     def clear_cookie(self):
@@ -52,17 +1467,17 @@ class DanmakuSender:
         self.bili_jct = None
         self.sessdata = None
         self.session.cookies.clear()
+        self._send_form = {}
+        self._login_cache.clear()
         self._log("已清除内存中的 Cookie（不会影响 config.json）")
 
     # -------------- 验证登录 --------------
-    def validate_cookie_login(self, timeout=8):
-        url = "https://api.bilibili.com/x/web-interface/nav"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
-            "Referer": "https://www.bilibili.com"
-        }
+    def validate_cookie_login(self, timeout=8, preconnect=True):
+        """preconnect=True 时在后台同时与发送主机建立连接，首条弹幕不必再做 DNS/TCP/TLS"""
+        if preconnect:
+            self._spawn(self.warm_up)
         try:
-            resp = self.session.get(url, headers=headers, timeout=timeout)
+            resp = self.session.get(NAV_URL, headers={"Referer": "https://www.bilibili.com"}, timeout=timeout)
         except requests.RequestException as e:
             return False, f"网络异常: {e}", None
 
@@ -83,118 +1498,954 @@ class DanmakuSender:
             return True, f"已登录（用户：{uname}）", j
         return False, f"未登录或 cookie 无效，返回 code={code}, message={j.get('message')}", j
 
+    def _credential_key(self):
+        if not self.sessdata and not self.bili_jct:
+            return None
+        raw = f"{self.sessdata or ''}\0{self.bili_jct or ''}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def cached_login(self):
+        """当前凭据在 LOGIN_CACHE_TTL 内验证通过过则返回该结果，否则返回 None"""
+        entry = self._login_cache.get(self._credential_key())
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def validate_cookie_login_cached(self, timeout=8, force=False):
+        """带缓存的登录验证；force=True 时忽略缓存重新请求"""
+        if not force:
+            cached = self.cached_login()
+            if cached is not None:
+                return cached
+        key = self._credential_key()
+        result = self.validate_cookie_login(timeout=timeout)
+        if result[0] and key is not None and key == self._credential_key():
+            self._login_cache[key] = (time.monotonic() + LOGIN_CACHE_TTL, result)
+        return result
+
+    def validate_cookie_async(self, callback, force=False):
+        """
+        后台验证登录，完成后调用 callback((ok, msg, raw))。
+        缓存命中时直接在当前线程回调，不启动线程。
+        """
+        if not force:
+            cached = self.cached_login()
+            if cached is not None:
+                callback(cached)
+                return
+        def job():
+            try:
+                result = self.validate_cookie_login_cached(force=force)
+            except Exception as e:
+                result = (False, f"验证异常: {e}", None)
+            callback(result)
+        self._spawn(job)
+
+    def _spawn(self, fn):
+        if self.executor is not None:
+            self.executor.submit(fn)
+        else:
+            threading.Thread(target=fn, daemon=True).start()
+
+    def warm_up(self, url=None, timeout=5):
+        """向发送主机发一个 HEAD 请求，让连接留在连接池中；失败无妨"""
+        url = url or PRECONNECT_URL
+        t0 = time.monotonic()
+        try:
+            self.session.head(url, timeout=timeout)
+        except requests.RequestException as e:
+            self._log(f"预连接 {url} 失败: {e}", level=DEBUG)
+            return False
+        self._log(f"已预连接 {url}，耗时 {(time.monotonic() - t0) * 1000:.0f} ms", level=DEBUG)
+        return True
+
     # -------------- 日志 --------------
-    def _log(self, s, to_file=True):
+    def _log(self, s, *args, to_file=True, level=INFO):
+        """
+        s 可以带 % 参数，也可以是返回字符串的函数；低于 log_level 的日志直接丢弃，
+        不做任何格式化。
+        """
+        if level < self.log_level:
+            return
+        if callable(s):
+            s = s()
+        elif args:
+            s = s % args
         stamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         line = f"[{stamp}] {s}"
-        try:
-            self.gui_log.insert(tk.END, line + "\n")
-            self.gui_log.see(tk.END)
-        except Exception:
-            pass
-        if to_file:
+        if self.gui_log is not None:
+            try:
+                self.gui_log(level, line)
+            except Exception:
+                pass
+        if to_file and self.log_to_file:
             try:
                 log_to_file(line)
             except Exception:
                 pass
 
     # -------------- 发送弹幕 --------------
+    def _headers_for(self, roomid):
+        headers = self._send_headers.get(roomid)
+        if headers is None:
+            headers = {"Origin": "https://live.bilibili.com", "Referer": f"https://live.bilibili.com/{roomid}"}
+            self._send_headers[roomid] = headers
+        return headers
+
     def send_single(self, roomid, message_text, timeout=10):
-        url = "https://api.live.bilibili.com/msg/send"
-        referer = f"https://live.bilibili.com/{roomid}"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
-            "Origin": "https://live.bilibili.com",
-            "Referer": referer,
-        }
+        """
+        发送一条弹幕。发出了请求时结果中的 telemetry 为本次的遥测记录（状态、code、延迟），
+        请求前就失败（例如缺少 bili_jct）时没有该字段。
+        """
+        url = SEND_URL
+        headers = self._headers_for(roomid)
 
         if not self.bili_jct:
             return {"ok": False, "error": "缺少 bili_jct (csrf)，请在 Cookie 中包含 bili_jct"}
 
-        data = {
-            "color": "16777215",
-            "fontsize": "25",
-            "mode": "1",
-            "msg": message_text,
-            "rnd": str(int(time.time())),
-            "roomid": str(roomid),
-            "bubble": "0",
-            "csrf_token": self.bili_jct,
-            "csrf": self.bili_jct,
-        }
-
+        form = self._send_form
+        if form.get("roomid") != str(roomid):
+            form = self._send_form = {
+                "color": "16777215",
+                "fontsize": "25",
+                "mode": "1",
+                "roomid": str(roomid),
+                "bubble": "0",
+                "csrf_token": self.bili_jct,
+                "csrf": self.bili_jct,
+            }
+        data = dict(form, msg=message_text, rnd=str(int(time.time())))
+
+        _connect_timing.seconds = 0.0
+        _connect_timing.count = 0
+        t_start = time.monotonic()
         try:
             resp = self.session.post(url, headers=headers, data=data, timeout=timeout)
         except requests.RequestException as e:
-            self._log(f"网络异常: {e}")
-            return {"ok": False, "error": f"网络异常: {e}"}
-
+            rec = self.telemetry.record(t_start, time.monotonic() - t_start, len(message_text),
+                                        connect_time=_connect_timing.seconds, error=type(e).__name__)
+            self._log(f"网络异常: {e}", level=WARNING)
+            return {"ok": False, "error": f"网络异常: {e}", "telemetry": rec}
+
+        latency = time.monotonic() - t_start
+        new_conn = _connect_timing.count > 0
+        connect_time = _connect_timing.seconds
         status = resp.status_code
         try:
             j = resp.json()
         except Exception:
+            rec = self.telemetry.record(t_start, latency, len(message_text), http_status=status,
+                                        connect_time=connect_time, new_conn=new_conn, error="non-json")
             text = resp.text
-            self._log(f"HTTP {status} 非 JSON 响应，前 1000 字: {text[:1000]}")
-            return {"ok": False, "http_status": status, "raw": text}
+            self._log(f"HTTP {status} 非 JSON 响应，前 1000 字: {text[:1000]}", level=WARNING)
+            return {"ok": False, "http_status": status, "raw": text, "retry_after": resp.headers.get("Retry-After"),
+                    "telemetry": rec}
 
         code = j.get("code")
         msg = j.get("message") or j.get("msg") or ""
-        self._log(f"HTTP {status} 返回 code={code} message={msg} json={json.dumps(j, ensure_ascii=False)[:1000]}")
+        rec = self.telemetry.record(t_start, latency, len(message_text), http_status=status, code=code,
+                                    ok=(status == 200 and code == 0 and msg not in CONTENT_REJECT_MESSAGES),
+                                    connect_time=connect_time, new_conn=new_conn)
+        if status == 200 and code == 0 and msg in CONTENT_REJECT_MESSAGES:
+            self._log(f"HTTP {status} 返回 code={code} message={msg}：内容被屏蔽", level=WARNING)
+            return {"ok": False, "rejected": True, "http_status": status, "code": code, "message": msg, "resp": j,
+                    "telemetry": rec}
         if status == 200 and code == 0:
-            return {"ok": True, "resp": j}
+            self._log(lambda: f"HTTP {status} 返回 code={code} message={msg} json={json.dumps(j, ensure_ascii=False)[:1000]}", level=DEBUG)
+            return {"ok": True, "resp": j, "telemetry": rec}
         else:
-            return {"ok": False, "http_status": status, "code": code, "message": msg, "resp": j}
+            self._log(f"HTTP {status} 返回 code={code} message={msg} json={json.dumps(j, ensure_ascii=False)[:1000]}", level=WARNING)
+            return {"ok": False, "http_status": status, "code": code, "message": msg, "resp": j,
+                    "retry_after": resp.headers.get("Retry-After"), "telemetry": rec}
 
     # -------------- 自动发送线程 --------------
-    def start_auto(self, roomid, messages, interval=2.0, randomize=False):
+    def start_auto(self, roomid, messages, interval=2.0, randomize=False, max_limited=BACKOFF_MAX_CONSECUTIVE,
+                   max_len=None, half_count=None, resume=True):
         if not messages:
             self._log("错误：弹幕列表为空，停止。")
             return
         if self.running.is_set():
             self._log("已经在运行中。")
             return
+        if self.thread is not None and self.thread.is_alive():
+            self._log("上一轮自动发送仍在退出中，请稍候再试。")
+            return
         self.running.set()
-        self.thread = threading.Thread(target=self._auto_loop, args=(roomid, messages, interval, randomize), daemon=True)
+        self.pacer.set_interval(interval)
+        self.pacer.reset_stats()
+        self.backoff.reset()
+        self.telemetry.new_session()
+        self.backoff.max_consecutive = max(1, int(max_limited))
+        self.preflight.reset()
+        if max_len is not None:
+            self.preflight.max_len = int(max_len)
+        if half_count is not None:
+            self.preflight.half_count = bool(half_count)
+        if randomize and hasattr(messages, "follow"):
+            self._log("跟随模式只能顺序发送，已忽略随机选取。", level=WARNING)
+            randomize = False
+        self.thread = threading.Thread(target=self._auto_loop, args=(roomid, messages, interval, randomize, resume), daemon=True)
         self.thread.start()
         self._log("已启动自动发送线程。")
 
-    def stop_auto(self):
+    def stop_auto(self, wait=True):
+        """wait=False 时只发出停止信号立即返回，线程退出后会记录日志并调用 on_stopped"""
         if self.running.is_set():
             self.running.clear()
             self._log("停止信号已发送，等待线程退出...")
-            if self.thread:
+            if wait and self.thread:
                 self.thread.join(timeout=5)
-            self._log("已停止自动发送。")
         else:
             self._log("当前没有运行中的自动发送。")
 
-    def _auto_loop(self, roomid, messages, interval, randomize):
+    def _record_history(self, *args, **kw):
+        try:
+            self.history.record(*args, **kw)
+        except Exception as e:
+            self._log(f"写入发送历史失败: {e}", level=WARNING)
+
+    def _auto_loop(self, roomid, messages, interval, randomize, resume=True, max_passes=None):
+        """
+        messages 可以是列表、ChunkIndex，也可以是 FileMessageSource 这类可重复迭代的弹幕源。
+        FollowingFileSource 不分轮次：发完已有内容后等待文件追加，直到停止。
+        顺序模式下 resume=True 时从发送历史中的游标处继续，而不是从第 1 条开始（跟随模式从保存的读取状态继续）。
+        max_passes 不为 None 时循环这么多轮后停止（随机模式下一轮为抽取 len(messages) 次）。
+        """
         counter = 0
+        history = self.history
+        source_key = session_id = None
+        start = 0
+        resume_state = None
+        follow = hasattr(messages, "follow")
+        try:
+            # 不记录历史时（如模拟运行）不计算弹幕源标识：列表和分块索引要哈希全部内容
+            if history.path:
+                source_key = history.source_key(messages, roomid)
+                source = getattr(messages, "filename", None) or f"列表（{len(messages)} 条）"
+                session_id = history.begin_session(source_key, source, roomid)
+                if resume and not randomize:
+                    if follow:
+                        resume_state = history.cursor_state(source_key)
+                    else:
+                        start = history.cursor(source_key)
+        except Exception as e:
+            self._log(f"发送历史不可用，本次不记录也不续传: {e}", level=WARNING)
+        if start:
+            self._log(f"从上次的位置继续：第 {start + 1} 条。")
+        elif resume_state:
+            self._log(f"从上次的位置继续：第 {resume_state['emitted'] + 1} 条（{resume_state['offset']} 字节之后）。")
+        if randomize and not hasattr(messages, "__getitem__"):
+            # 随机选取需要随机访问：优先用分块索引，否则只能先把弹幕源展开
+            messages = messages.as_sequence() if hasattr(messages, "as_sequence") else list(messages)
+        base_interval = self.pacer.interval
+        preflight = self.preflight
+        it = None
+        index = -1
+        retry_msg = None  # 被限流的消息在退避后重发，不跳过
+        pass_sent = False  # 本轮是否有弹幕通过了发送前检查
+        skipped_run = 0
+        passes = picks = 0
         while self.running.is_set():
             try:
                 counter += 1
-                msg = random.choice(messages) if randomize else messages[(counter-1) % len(messages)]
-                res = self.send_single(roomid, msg)
+                if retry_msg is not None:
+                    msg, retry_msg = retry_msg, None
+                else:
+                    if randomize:
+                        if max_passes is not None and messages and picks >= max_passes * len(messages):
+                            self._log(f"已完成 {max_passes} 轮，停止。")
+                            self.running.clear()
+                            break
+                        picks += 1
+                        index = random.randrange(len(messages)) if messages else -1
+                        msg = messages[index] if messages else None
+                    elif follow:
+                        if it is None:
+                            it = messages.follow(self.running.is_set, resume=resume_state, log=self._log)
+                        msg = next(it, None)
+                        if msg is None:
+                            break  # 已停止
+                        index = messages.emitted - 1
+                    else:
+                        if it is None and start:
+                            # 续传：本轮从游标处开始，这半轮不参与"整轮都被跳过"的判断
+                            it = iter_messages_from(messages, start)
+                            index = start - 1
+                            pass_sent = True
+                        msg = next(it, None) if it is not None else None
+                        index += 1
+                        if msg is None:
+                            # 一轮发送完毕（或首次进入），从头开始循环
+                            if it is not None:
+                                passes += 1
+                                if max_passes is not None and passes >= max_passes:
+                                    self._log(f"已完成 {max_passes} 轮，停止。")
+                                    self.running.clear()
+                                    break
+                            if it is not None and not pass_sent:
+                                self._log("错误：整轮弹幕都未通过发送前检查，停止。" + preflight.status_text(), level=ERROR)
+                                self.running.clear()
+                                break
+                            close = getattr(it, "close", None)
+                            if close:
+                                close()
+                            it = iter(messages)
+                            index = 0
+                            preflight.begin_pass()
+                            pass_sent = False
+                            msg = next(it, None)
+                    if msg is None:
+                        self._log("错误：弹幕源为空，停止。")
+                        self.running.clear()
+                        break
+                    # 跟随模式没有"轮"，整个会话都算一轮的话后来追加的相同内容会被当成重复丢掉
+                    reason = preflight.check(msg, duplicates=not (randomize or follow))
+                    if reason is not None:
+                        counter -= 1
+                        skipped_run += 1
+                        self._log(lambda: f"跳过弹幕（{Preflight.REASONS[reason]}）: {msg}")
+                        if randomize and skipped_run >= max(100, 10 * len(messages)):
+                            self._log("错误：连续抽到的弹幕都未通过发送前检查，停止。" + preflight.status_text(), level=ERROR)
+                            self.running.clear()
+                            break
+                        continue
+                    pass_sent = True
+                    skipped_run = 0
+                # 经由共享发送队列发出，节奏由 pacer 控制（与单次测试发送互斥）
+                res = self.send_queue.submit(roomid, msg, should_continue=self.running.is_set).result()
+                if res.get("cancelled"):
+                    break
+                rec = res.get("telemetry")  # 本次发送的记录；没有发出请求时为 None
+                if counter == 1 and rec:
+                    self._log(f"首条发送延迟: {rec['latency_ms']} ms（新建连接={rec['new_conn']}）")
                 if res.get("ok"):
+                    outcome = "ok"
+                elif res.get("rejected"):
+                    outcome = "rejected"
+                elif res.get("http_status") in AUTH_FAIL_HTTP_STATUS:
+                    outcome = "auth"
+                elif self.backoff.is_limited(res):
+                    outcome = "limited"
+                else:
+                    outcome = "error"
+                # 送达或被屏蔽（不会再重发）都算这一条已处理完，游标前移
+                advance = not randomize and outcome in ("ok", "rejected")
+                self._record_history(session_id, source_key, index, msg, outcome,
+                                     rec["http_status"] if rec else res.get("http_status"),
+                                     rec["code"] if rec else res.get("code"),
+                                     rec["latency_ms"] if rec else None,
+                                     advance=advance, state=messages.checkpoint() if follow and advance else None)
+                if outcome == "ok":
+                    self.backoff.on_success()
                     self._log(f"第{counter}条弹幕发送成功: {msg}")
+                elif outcome == "rejected":
+                    preflight.rejected.add(msg)
+                    self._log(f"第{counter}条弹幕被屏蔽（message={res.get('message')}），已记入拒绝缓存，之后不再发送: {msg}", level=WARNING)
                 else:
                     code = res.get("code")
                     http_status = res.get("http_status")
                     err = res.get("error") or res.get("message") or res.get("raw") or res.get("resp")
-                    self._log(f"第{counter}条弹幕发送失败: http_status={http_status} code={code} err={err}")
-                    if http_status in (401, 403, 412, 429):
-                        self._log(f"检测到 HTTP {http_status}，自动停止以避免风控（请检查 cookie/csrf/referer）。")
+                    self._log(f"第{counter}条弹幕发送失败: http_status={http_status} code={code} err={err}", level=WARNING)
+                    if http_status in AUTH_FAIL_HTTP_STATUS:
+                        self._log(f"检测到 HTTP {http_status}，自动停止以避免风控（请检查 cookie/csrf/referer）。", level=ERROR)
                         self.running.clear()
                         break
-                sleep_time = max(0.1, float(interval)) if interval else 2.0
-                time.sleep(sleep_time + random.uniform(0, 0.5))
+                    if self.backoff.is_limited(res):
+                        delay = self.backoff.on_limited(res.get("retry_after"))
+                        if delay is None:
+                            self._log(f"连续 {self.backoff.consecutive} 次被限流（HTTP {http_status} code={code}），自动停止。", level=ERROR)
+                            self.running.clear()
+                            break
+                        self.pacer.hold(delay)
+                        self.pacer.set_interval(base_interval * self.backoff.interval_factor)
+                        retry_msg = msg
+                        self._log(f"被限流（HTTP {http_status} code={code}），暂停 {delay:.1f}s 后重发，"
+                                  f"发送间隔调整为 {self.pacer.interval:.2f}s。{self.backoff.status_text()}", level=WARNING)
             except Exception as e:
-                self._log("自动线程异常: " + str(e))
-                self._log(traceback.format_exc())
+                self._log("自动线程异常: " + str(e), level=ERROR)
+                self._log(traceback.format_exc(), level=ERROR)
                 self.running.clear()
                 break
+        close = getattr(it, "close", None)
+        if close:
+            close()
+        try:
+            history.end_session(session_id)
+        except Exception:
+            pass
+        self.telemetry.export()
+        self._log(f"发送间隔统计（秒）: {self.pacer.stats()}")
+        if preflight.saved:
+            self._log(preflight.status_text())
+        self._log("已停止自动发送。")
+        if self.on_stopped is not None:
+            self.on_stopped()
+
+# ----------------- 模拟运行 -----------------
+def _counter_quantile(counter, q):
+    total = sum(counter.values())
+    acc = 0
+    for k in sorted(counter):
+        acc += counter[k]
+        if acc >= total * q:
+            return k
+    return None
+
+def dry_run(messages, interval=2.0, randomize=False, max_len=MAX_MESSAGE_LEN, half_count=False,
+            latency=DRY_RUN_LATENCY, passes=1, jitter=SEND_JITTER_MAX):
+    """
+    模拟运行：用真实的分割结果、发送前检查和 _auto_loop 调度逻辑跑 passes 轮，
+    但时间由 VirtualClock 推进，请求由固定耗时 latency、总是成功的模拟响应代替，
+    不发出网络请求也不真正等待。返回预计时长、长度分布和未通过发送前检查的弹幕。
+    """
+    clock = VirtualClock()
+    warnings = []
+    sim = DanmakuSender(lambda level, line: warnings.append(line), log_level=WARNING, offline=True)
+    sim.preflight.max_len = max_len
+    sim.preflight.half_count = half_count
+    sim.pacer = SendPacer(jitter=jitter, clock=clock.clock, sleep=clock.sleep, poll=max(interval, 1.0))
+    lengths = collections.Counter()
+    starts = []
+
+    def respond(roomid, text):
+        starts.append(clock.now)
+        lengths[len(text)] += 1
+        clock.sleep(latency)
+        return {"ok": True}
+    sim.send_queue = InlineSendQueue(respond, sim.pacer)
+    sim.pacer.set_interval(interval)
+    sim.running.set()
+    t0 = time.perf_counter()
+    sim._auto_loop("dry-run", messages, interval, randomize, resume=False, max_passes=passes)
+    elapsed = time.perf_counter() - t0
+
+    sent = sum(lengths.values())
+    duration = starts[-1] + latency - starts[0] if starts else 0.0
+    return {
+        "source_count": len(messages) if hasattr(messages, "__len__") else None,
+        "passes": passes,
+        "sent": sent,
+        "skipped": dict(sim.preflight.skipped),
+        "skipped_examples": list(sim.preflight.examples),
+        "interval": sim.pacer.interval,
+        "jitter": jitter,
+        "latency": latency,
+        "duration_s": round(duration, 1),
+        "mean_gap_s": round(duration / sent, 3) if sent else None,
+        "lengths": {
+            "min": min(lengths) if lengths else None,
+            "mean": round(sum(k * v for k, v in lengths.items()) / sent, 1) if sent else None,
+            "p50": _counter_quantile(lengths, 0.5),
+            "p90": _counter_quantile(lengths, 0.9),
+            "max": max(lengths) if lengths else None,
+            "histogram": dict(sorted(lengths.items())),
+        },
+        "warnings": warnings,
+        "simulated_in_s": round(elapsed, 3),
+    }
+
+def format_dry_run(report, examples=20):
+    """把 dry_run() 的结果整理成多行文字"""
+    skipped = sum(report["skipped"].values())
+    lines = [f"模拟运行（未发送任何请求，模拟耗时 {report['simulated_in_s']} s）"]
+    src = report["source_count"]
+    head = f"弹幕源共 {src} 条，" if src is not None else ""
+    detail = " / ".join(f"{Preflight.REASONS[k]} {v}" for k, v in sorted(report["skipped"].items(), key=lambda kv: -kv[1]))
+    lines.append(f"{head}{report['passes']} 轮会发送 {report['sent']} 条，跳过 {skipped} 条" + (f"（{detail}）" if detail else ""))
+    duration = datetime.timedelta(seconds=round(report["duration_s"]))
+    finish = datetime.datetime.now() + duration
+    lines.append(f"预计时长 {duration}（间隔 {report['interval']}s + 抖动 ≤{report['jitter']}s，单次请求按 {report['latency']}s 计），"
+                 f"现在开始约 {finish.strftime('%Y-%m-%d %H:%M')} 结束")
+    ln = report["lengths"]
+    if report["sent"]:
+        lines.append(f"长度分布：最短 {ln['min']} / 平均 {ln['mean']} / p50 {ln['p50']} / p90 {ln['p90']} / 最长 {ln['max']} 字")
+        top = sorted(ln["histogram"].items(), key=lambda kv: -kv[1])[:10]
+        lines.append("  " + "，".join(f"{k} 字 {v} 条" for k, v in sorted(top)))
+    if report["skipped_examples"]:
+        lines.append(f"未通过发送前检查的弹幕（最近 {min(examples, len(report['skipped_examples']))} 条）：")
+        for reason, msg in report["skipped_examples"][-examples:]:
+            lines.append(f"  [{Preflight.REASONS[reason]}] {msg}")
+    for w in report["warnings"]:
+        lines.append("  " + w)
+    return "\n".join(lines)
+
+# ----------------- 性能分析 -----------------
+def current_rss():
+    """当前进程的常驻内存（字节）；取不到时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # 只能取到峰值：Linux 为 KB，macOS 为字节
+        return rss if sys.platform == "darwin" else rss * 1024
+    except (ImportError, OSError):
+        return None
+
+class _ProfileStats:
+    """把已采集的统计 dict 包装成 pstats.Stats 能接受的对象"""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+class Profiler:
+    """
+    可选的性能分析。start(sender) 之后 _auto_loop、send_single、_log 和 Chunker.feed/flush 经 cProfile 统计，
+    tracemalloc 记录分配位置；后台线程每 interval 秒把热点函数、分配最多的代码行（以及相对上一次的增长）
+    和进程 RSS 写到 out_dir。未启动时不包装任何函数，没有额外开销。
+    Python 3.12 起 cProfile 对所有线程生效，只用一个全局 Profile；更早的版本每个线程各用一个，
+    在最外层的被包装函数中开关。写快照时直接读取各个 Profile 已完成调用的统计（不停止统计），
+    所以快照总是包含到写出时刻为止的数据。
+    """
+    GLOBAL_PROFILE = sys.version_info >= (3, 12)
+
+    def __init__(self, out_dir=PROFILE_DIR, interval=PROFILE_INTERVAL, top=PROFILE_TOP):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.top = top
+        self.enabled = False
+        self._patched = []        # (对象, 属性名, 原值, 原来是否是实例属性)
+        self._local = threading.local()
+        self._profiles = {}       # 线程 ident -> Profile
+        self._global = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._prev_snapshot = None
+        self._count = 0
+
+    def start(self, sender=None):
+        if self.enabled:
+            return
+        import cProfile, tracemalloc
+        os.makedirs(self.out_dir, exist_ok=True)
+        # 每次开启都重新统计，不混入上一次开启期间的数据
+        self._local = threading.local()
+        with self._lock:
+            self._profiles = {}
+        tracemalloc.start(PROFILE_TRACE_FRAMES)
+        if self.GLOBAL_PROFILE:
+            self._global = cProfile.Profile()
+            self._global.enable()
+        else:
+            if sender is not None:
+                for name in ("_auto_loop", "send_single", "_log"):
+                    self._patch(sender, name)
+                self._patch(sender.send_queue, "send")  # 发送队列持有的是 send_single 的引用
+            self._patch(Chunker, "feed")
+            self._patch(Chunker, "flush")
+        self.enabled = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """写出最后一份快照并恢复被包装的函数"""
+        if not self.enabled:
+            return
+        import tracemalloc
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        self.snapshot()
+        for obj, name, original, own in reversed(self._patched):
+            if own:
+                setattr(obj, name, original)
+            else:
+                delattr(obj, name)
+        self._patched = []
+        if self._global is not None:
+            self._global.disable()
+            self._global = None
+        tracemalloc.stop()
+        self._prev_snapshot = None
+        self.enabled = False
+
+    def _patch(self, obj, name):
+        if isinstance(obj, type):
+            original, own = vars(obj)[name], True
+        else:
+            original, own = getattr(obj, name), name in vars(obj)
+        self._patched.append((obj, name, original, own))
+        setattr(obj, name, self.wrap(original))
+
+    def wrap(self, fn):
+        import functools
+        local = self._local
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kw):
+            depth = getattr(local, "depth", 0)
+            prof = self._thread_profile() if depth == 0 else local.profile
+            if depth == 0:
+                prof.enable()
+            local.depth = depth + 1
+            try:
+                return fn(*args, **kw)
+            finally:
+                local.depth = depth
+                if depth == 0:
+                    prof.disable()
+        return wrapper
+
+    def _thread_profile(self):
+        prof = getattr(self._local, "profile", None)
+        if prof is None:
+            import cProfile
+            prof = self._local.profile = cProfile.Profile()
+            with self._lock:
+                self._profiles[threading.get_ident()] = prof
+        return prof
+
+    @staticmethod
+    def _read_stats(prof):
+        """读取 Profile 中已完成调用的统计；snapshot_stats 不会像 create_stats 那样停止统计"""
+        prof.snapshot_stats()
+        return dict(prof.stats)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.snapshot()
+            except Exception:
+                pass
+
+    def snapshot(self):
+        """写出一份快照：<序号>.prof（pstats 格式）、<序号>.txt（可读报告），并在 summary.jsonl 追加一行"""
+        import io, pstats, tracemalloc, cProfile
+        with self._lock:
+            profiles = [self._global] if self._global is not None else list(self._profiles.values())
+            collected = [d for d in map(self._read_stats, profiles) if d]
+        self._count += 1
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.out_dir, f"{stamp}-{self._count:04d}")
+        out = io.StringIO()
+        rss = current_rss()
+        traced, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+        out.write(f"时间 {datetime.datetime.now().isoformat(timespec='seconds')}  RSS {rss}  "
+                  f"tracemalloc 当前 {traced} 峰值 {peak}（字节）\n\n")
+
+        calls = total_tt = None
+        if collected:
+            stats = pstats.Stats(_ProfileStats(collected[0]), stream=out)
+            for d in collected[1:]:
+                stats.add(_ProfileStats(d))
+            calls, total_tt = stats.total_calls, round(stats.total_tt, 6)
+            stats.dump_stats(base + ".prof")
+            out.write("== 热点函数（按累计耗时）==\n")
+            stats.sort_stats("cumulative").print_stats(self.top)
+        else:
+            out.write("== 热点函数 ==\n尚未采集到数据（被包装的函数还没有被调用）\n")
+
+        if tracemalloc.is_tracing():
+            # 去掉分析工具自身和模块导入产生的分配
+            snap = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, mod.__file__) for mod in (tracemalloc, pstats, cProfile)]
+                + [tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")])
+            out.write("\n== 分配最多的代码行 ==\n")
+            for stat in snap.statistics("lineno")[:self.top]:
+                out.write(f"{stat}\n")
+            if self._prev_snapshot is not None:
+                out.write("\n== 相对上一份快照的增长 ==\n")
+                for stat in snap.compare_to(self._prev_snapshot, "lineno")[:self.top]:
+                    out.write(f"{stat}\n")
+            self._prev_snapshot = snap
+
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+        summary = {"ts": round(time.time(), 3), "file": os.path.basename(base) + ".txt", "rss": rss,
+                   "traced": traced, "traced_peak": peak, "calls": calls, "total_tt": total_tt}
+        with open(os.path.join(self.out_dir, "summary.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary) + "\n")
+        return base + ".txt"
+
+# ----------------- 配置存储 -----------------
+def atomic_write(path, text):
+    """先写同目录下的临时文件再 os.replace，写到一半崩溃也不会留下半截文件"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+class ConfigStore:
+    """
+    config.json 只保存标量设置（紧凑 JSON，原子写入）；较大的弹幕列表存到旁边的
+    <config>.messages.<哈希>.txt（每行一条），config.json 中用 messages_ref 记录文件名、sha1 和条数，
+    需要时才由 load_messages() 读取。仍兼容直接写在 config.json 里的 messages。
+    """
+    def __init__(self, path=CONFIG_PATH, inline_max_bytes=CONFIG_INLINE_MESSAGES_MAX_BYTES):
+        self.path = path
+        self.inline_max_bytes = inline_max_bytes
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _ref_path(self, ref):
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), ref["file"])
+
+    def load(self):
+        """读取设置；外置的弹幕列表不在这里读取"""
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_messages(self, cfg):
+        """取得配置中的弹幕列表：内联的直接返回，外置的读取对应文件并核对哈希"""
+        ref = cfg.get("messages_ref")
+        if not ref:
+            return list(cfg.get("messages", []))
+        path = self._ref_path(ref)
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        if hashlib.sha1(text.encode("utf-8")).hexdigest() != ref.get("sha1"):
+            raise ValueError(f"{path} 与 {self.path} 中记录的哈希不一致（文件被修改或损坏），请重新保存配置。")
+        return text.split("\n") if text else []
+
+    def _file_sha1(self, path):
+        try:
+            with open(path, "rb") as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            return None
+
+    def save(self, cfg):
+        """
+        保存设置；cfg 中的 messages 按大小决定内联还是外置。
+        cfg 没有 messages 而带有 messages_ref 时（列表还没读出来），原样保留该引用和文件。
+        """
+        cfg = dict(cfg)
+        messages = cfg.pop("messages", None)
+        keep_ref = cfg.pop("messages_ref", None) if messages is None else None
+        messages = messages or []
+        cfg.pop("messages_ref", None)
+        old_ref = None
+        if self.exists():
+            try:
+                old_ref = self.load().get("messages_ref")
+            except (OSError, ValueError, AttributeError):
+                pass
+        text = "\n".join(messages)
+        new_path = None
+        if keep_ref:
+            cfg["messages_ref"] = keep_ref
+            new_path = self._ref_path(keep_ref)
+        elif len(text.encode("utf-8")) > self.inline_max_bytes:
+            sha1 = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            stem = os.path.splitext(os.path.basename(self.path))[0]
+            ref = {"file": f"{stem}.messages.{sha1[:16]}.txt", "sha1": sha1, "count": len(messages)}
+            new_path = self._ref_path(ref)
+            if self._file_sha1(new_path) != sha1:  # 内容相同的列表不必重写，被改动或损坏的重写
+                atomic_write(new_path, text)
+            cfg["messages_ref"] = ref
+        else:
+            cfg["messages"] = messages
+        atomic_write(self.path, json.dumps(cfg, ensure_ascii=False, separators=(",", ":")))
+        if old_ref and old_ref.get("file"):
+            old_path = self._ref_path(old_ref)
+            if old_path != new_path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    def delete(self):
+        """删除配置文件及其外置的弹幕列表"""
+        try:
+            ref = self.load().get("messages_ref")
+        except (OSError, ValueError, AttributeError):
+            ref = None
+        os.remove(self.path)
+        if ref and ref.get("file"):
+            try:
+                os.remove(self._ref_path(ref))
+            except OSError:
+                pass
 
 # ----------------- GUI -----------------
+class VirtualList:
+    """
+    只渲染可见行的只读列表视图：数据由 count() 和 fetch(start, stop) 提供，
+    不论数据有多少行，Text 控件里始终只有一屏内容。
+    follow=True 时新数据到达会自动停在末尾。
+    """
+    def __init__(self, master, count, fetch, height=18, follow=True):
+        self.count = count
+        self.fetch = fetch
+        self.rows = height
+        self.top = 0
+        self.follow = follow
+        self._auto_follow = follow
+        self.frame = tk.Frame(master)
+        self.vbar = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.hbar = tk.Scrollbar(self.frame, orient=tk.HORIZONTAL)
+        self.text = tk.Text(self.frame, height=height, wrap=tk.NONE, state=tk.DISABLED,
+                            xscrollcommand=self.hbar.set)
+        self.hbar.configure(command=self.text.xview)
+        self.vbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.hbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self._linespace = tkfont.Font(font=self.text["font"]).metrics("linespace")
+        self.text.bind("<Configure>", self._on_resize)
+        self.text.bind("<MouseWheel>", lambda e: self._scroll_units(-1 if e.delta > 0 else 1, 3))
+        self.text.bind("<Button-4>", lambda e: self._scroll_units(-1, 3))
+        self.text.bind("<Button-5>", lambda e: self._scroll_units(1, 3))
+
+    def pack(self, **kw):
+        self.frame.pack(**kw)
+
+    def _on_resize(self, event):
+        rows = max(1, event.height // max(1, self._linespace))
+        if rows != self.rows:
+            self.rows = rows
+            self.refresh()
+
+    def _on_scrollbar(self, action, value, unit=None):
+        total = self.count()
+        if action == "moveto":
+            self.scroll_to(int(float(value) * total))
+        elif action == "scroll":
+            step = self.rows if unit == "pages" else 1
+            self.scroll_to(self.top + int(value) * step)
+
+    def _scroll_units(self, direction, n):
+        self.scroll_to(self.top + direction * n)
+        return "break"
+
+    def scroll_to(self, index):
+        """把第 index 行滚动到顶部；滚到末尾时恢复自动跟随"""
+        total = self.count()
+        self.top = max(0, min(int(index), total - self.rows))
+        self.follow = self._auto_follow and self.top >= total - self.rows
+        self.refresh()
+
+    def refresh(self):
+        total = self.count()
+        if self.follow or self.top > max(0, total - self.rows):
+            self.top = max(0, total - self.rows)
+        lines = self.fetch(self.top, self.top + self.rows)
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(lines))
+        self.text.configure(state=tk.DISABLED)
+        if total:
+            self.vbar.set(self.top / total, min(1.0, (self.top + self.rows) / total))
+        else:
+            self.vbar.set(0.0, 1.0)
+
+class LogView:
+    """日志区：LogBuffer + VirtualList，附带级别过滤和搜索框"""
+    LEVEL_CHOICES = [("全部", DEBUG), ("INFO", INFO), ("WARNING", WARNING), ("ERROR", ERROR)]
+
+    def __init__(self, master, capacity=LOG_VIEW_CAPACITY, height=18):
+        self.buffer = LogBuffer(capacity)
+        self.frame = tk.Frame(master)
+        bar = tk.Frame(self.frame)
+        bar.pack(fill=tk.X)
+        tk.Label(bar, text="日志:").pack(side=tk.LEFT)
+        tk.Label(bar, text="级别:").pack(side=tk.LEFT, padx=(12,0))
+        self.level_var = tk.StringVar(value="全部")
+        tk.OptionMenu(bar, self.level_var, *[name for name, _ in self.LEVEL_CHOICES],
+                      command=lambda _: self._apply_filter()).pack(side=tk.LEFT)
+        tk.Label(bar, text="搜索:").pack(side=tk.LEFT, padx=(8,0))
+        self.search_entry = tk.Entry(bar, width=24)
+        self.search_entry.pack(side=tk.LEFT)
+        self.search_entry.bind("<KeyRelease>", lambda e: self._apply_filter())
+        self.list = VirtualList(self.frame, count=lambda: len(self.buffer), fetch=self.buffer.lines, height=height)
+        self.list.pack(fill=tk.BOTH, expand=True)
+
+    def pack(self, **kw):
+        self.frame.pack(**kw)
+
+    def _apply_filter(self):
+        level = dict(self.LEVEL_CHOICES).get(self.level_var.get(), DEBUG)
+        self.buffer.set_filter(min_level=level, search=self.search_entry.get())
+        self.list.follow = True
+        self.list.refresh()
+
+    def append_many(self, items):
+        """items 为 (level, line) 列表；整批追加后只重绘一次"""
+        for level, line in items:
+            self.buffer.append(level, line)
+        self.list.refresh()
+
+    def clear(self):
+        self.buffer.clear()
+        self.list.refresh()
+
+class ChunkPreview:
+    """
+    分块预览窗口：VirtualList 直接从 ChunkIndex 读取可见的几十块，
+    不论文件分成多少块，控件里都只有一屏内容；支持跳到第 N 块。
+    """
+    def __init__(self, root):
+        self.index = None
+        self.window = tk.Toplevel(root)
+        self.window.geometry("720x480")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        bar = tk.Frame(self.window)
+        bar.pack(fill=tk.X, padx=8, pady=(8,4))
+        self.total_var = tk.StringVar(value="正在分割...")
+        tk.Label(bar, textvariable=self.total_var).pack(side=tk.LEFT)
+        tk.Button(bar, text="跳转", command=self._jump).pack(side=tk.RIGHT)
+        self.jump_entry = tk.Entry(bar, width=10)
+        self.jump_entry.pack(side=tk.RIGHT, padx=4)
+        self.jump_entry.bind("<Return>", lambda e: self._jump())
+        tk.Label(bar, text="跳到第几条:").pack(side=tk.RIGHT)
+        self.list = VirtualList(self.window, count=self._count, fetch=self._fetch, height=24, follow=False)
+        self.list.pack(fill=tk.BOTH, expand=True, padx=8, pady=(0,8))
+
+    @property
+    def is_open(self):
+        return self.window is not None
+
+    def _count(self):
+        return len(self.index) if self.index is not None else 0
+
+    def _fetch(self, start, stop):
+        if self.index is None:
+            return []
+        width = len(str(len(self.index)))
+        return [f"{i:>{width}}  {c}" for i, c in enumerate(self.index.lines(start, stop), start + 1)]
+
+    def loading(self, filename):
+        self.window.title(f"分块预览 - {filename}")
+        self.index = None
+        self.total_var.set("正在分割...")
+        self.list.scroll_to(0)
+        self.window.lift()
+
+    def show(self, index, filename):
+        self.index = index
+        meta = index.meta
+        self.window.title(f"分块预览 - {filename}")
+        self.total_var.set(f"共 {len(index)} 条（分割长度={meta.get('chunk_size')}，英文/数字算0.5={meta.get('half_count')}）")
+        self.list.scroll_to(0)
+
+    def _jump(self):
+        try:
+            n = int(self.jump_entry.get().strip())
+        except ValueError:
+            return
+        self.list.scroll_to(n - 1)
+
+    def close(self):
+        self.window.destroy()
+        self.window = None
+        self.index = None
+
 class App:
     def __init__(self, root):
         self.root = root
@@ -216,6 +2467,18 @@ class App:
 
         self.random_var = tk.IntVar(value=0)
         tk.Checkbutton(frame, text="随机从列表选取弹幕", variable=self.random_var).grid(row=0, column=4, sticky=tk.W, padx=(12,0))
+        self.resume_var = tk.IntVar(value=1)
+        tk.Checkbutton(frame, text="从上次位置继续", variable=self.resume_var).grid(row=1, column=4, sticky=tk.W, padx=(12,0))
+
+        tk.Label(frame, text="连续限流几次后停止:").grid(row=0, column=5, sticky=tk.W, padx=(8,0))
+        self.max_limited_entry = tk.Entry(frame, width=4)
+        self.max_limited_entry.insert(0, str(BACKOFF_MAX_CONSECUTIVE))
+        self.max_limited_entry.grid(row=0, column=6, sticky=tk.W)
+
+        tk.Label(frame, text="长度上限(0=不限):").grid(row=0, column=7, sticky=tk.W, padx=(8,0))
+        self.max_len_entry = tk.Entry(frame, width=4)
+        self.max_len_entry.insert(0, str(MAX_MESSAGE_LEN))
+        self.max_len_entry.grid(row=0, column=8, sticky=tk.W)
 
         # Cookie 粘贴
         tk.Label(root, text="Cookie（完整复制浏览器中的 cookie 字符串，例如: SESSDATA=xxx; bili_jct=yyy; ...）:").pack(anchor=tk.W, padx=8)
@@ -240,12 +2503,15 @@ class App:
 
         self.half_count_var = tk.IntVar(value=0)
         tk.Checkbutton(file_frame, text="英文/数字算0.5", variable=self.half_count_var).pack(side=tk.LEFT, padx=(0,8))
+        self.follow_var = tk.IntVar(value=0)
+        tk.Checkbutton(file_frame, text="跟随文件追加", variable=self.follow_var).pack(side=tk.LEFT, padx=(0,8))
 
         tk.Label(file_frame, text="文件名:").pack(side=tk.LEFT)
         self.file_entry = tk.Entry(file_frame, width=36)
         self.file_entry.insert(0, "message.txt")
         self.file_entry.pack(side=tk.LEFT, padx=4)
-        tk.Button(file_frame, text="加载并预览文件", command=self.load_and_preview_file).pack(side=tk.LEFT, padx=6)
+        self.preview_btn = tk.Button(file_frame, text="加载并预览文件", command=self.load_and_preview_file)
+        self.preview_btn.pack(side=tk.LEFT, padx=6)
 
         # 按钮区域
         btn_frame = tk.Frame(root)
@@ -257,6 +2523,9 @@ class App:
         self.test_send_btn = tk.Button(btn_frame, text="测试发送 1 条", command=self.test_send_once)
         self.test_send_btn.pack(side=tk.LEFT, padx=6)
 
+        self.dry_run_btn = tk.Button(btn_frame, text="模拟运行", command=self.simulate_run)
+        self.dry_run_btn.pack(side=tk.LEFT, padx=6)
+
         self.start_btn = tk.Button(btn_frame, text="开始自动发送", command=self.start_auto)
         self.start_btn.pack(side=tk.LEFT, padx=6)
         self.stop_btn = tk.Button(btn_frame, text="停止自动发送", command=self.stop_auto)
@@ -276,13 +2545,33 @@ class App:
 
         self.clear_log_btn = tk.Button(btn_frame, text="清空日志", command=self.clear_log)
         self.clear_log_btn.pack(side=tk.RIGHT)
+        self.profile_var = tk.IntVar(value=0)
+        tk.Checkbutton(btn_frame, text="性能分析", variable=self.profile_var,
+                       command=self._toggle_profile).pack(side=tk.RIGHT, padx=6)
+
+        # 状态栏：发送统计（先于日志区放到底部，窗口缩小时也不会被挤掉）
+        self.status_var = tk.StringVar(value="")
+        tk.Label(root, textvariable=self.status_var, anchor=tk.W).pack(side=tk.BOTTOM, fill=tk.X, padx=8, pady=(0,4))
 
-        # 日志区
-        tk.Label(root, text="日志:").pack(anchor=tk.W, padx=8)
-        self.log = scrolledtext.ScrolledText(root, height=18)
+        # 日志区：固定容量缓冲 + 只渲染可见行
+        self.log = LogView(root, height=18)
         self.log.pack(fill=tk.BOTH, expand=True, padx=8, pady=(0,8))
 
-        self.sender = DanmakuSender(self.log)
+        # 日志先进入队列，由主线程定时批量追加（Tk 控件只能在主线程操作）；
+        # 其他后台结果经事件总线回到主线程，耗时任务交给工作线程池，界面回调都立即返回
+        self._log_queue = queue.SimpleQueue()
+        self.bus = UiEventBus()
+        self.workers = WorkerPool(self.bus)
+        self.sender = DanmakuSender(lambda level, line: self._log_queue.put((level, line)),
+                                    executor=self.workers, on_stopped=lambda: self.bus.emit("stopped"))
+        self.bus.on("stopped", self._on_sender_stopped)
+        self.chunk_cache = ChunkIndexCache()
+        self.preview = None
+        self.profiler = Profiler()
+        self._unloaded_messages_ref = None  # 已加载配置中外置、但还没有填入编辑区的弹幕列表
+
+        self.root.after(LOG_DRAIN_MS, self._drain_log)
+        self.root.after(STATUS_REFRESH_MS, self._refresh_status)
 
         # 尝试自动加载 config（但不自动验证）
         try:
@@ -294,79 +2583,67 @@ class App:
     # ---------------- 文件处理逻辑 ----------------
     def is_ascii_alnum(self, ch):
         """判断字符是否为 ASCII 字母或数字"""
-        # ord范围检查：0-127 and isalnum
-        return ord(ch) < 128 and ch.isalnum()
+        return is_ascii_alnum(ch)
 
     def load_messages_from_file(self, filename, chunk_size=20, half_count=False):
         """
         读取 filename（utf-8），移除所有空白(包含空格/换行/制表符)，
         然后按 chunk_size 分割并返回字符串列表。
         如果 half_count=True，则 ASCII 字母/数字计 0.5，其他字符计 1。
+        需要边读边发时请用 FileMessageSource，它不会生成完整列表。
         """
-        if not os.path.exists(filename):
-            raise FileNotFoundError(f"{filename} 不存在")
-        with open(filename, "r", encoding="utf-8") as f:
-            raw = f.read()
-        # 去除所有空白字符（空格、换行、制表符等）
-        cleaned = re.sub(r"\s+", "", raw)
-        if not cleaned:
-            return []
-
-        # 防坏输入
-        try:
-            chunk_size_val = int(chunk_size)
-            if chunk_size_val < 1:
-                chunk_size_val = 20
-        except Exception:
-            chunk_size_val = 20
+        return list(self.chunk_cache.get_or_build(filename, chunk_size=chunk_size, half_count=half_count))
 
-        if not half_count:
-            # 简单切割
-            chunks = [cleaned[i:i+chunk_size_val] for i in range(0, len(cleaned), chunk_size_val)]
-            return chunks
-
-        # half_count=True 的复杂计数逻辑
-        chunks = []
-        current = []
-        acc = 0.0
-        for ch in cleaned:
-            w = 0.5 if self.is_ascii_alnum(ch) else 1.0
-            # If adding this char exceeds chunk_size, then flush current chunk first
-            if acc + w > chunk_size_val and current:
-                chunks.append("".join(current))
-                current = []
-                acc = 0.0
-            current.append(ch)
-            acc += w
-        if current:
-            chunks.append("".join(current))
-        return chunks
-
-    def load_and_preview_file(self):
+    def _file_settings(self):
         filename = self.file_entry.get().strip() or "message.txt"
         try:
             chunk_size = int(self.chunk_entry.get().strip() or 20)
-            half_count = bool(self.half_count_var.get())
         except Exception:
             chunk_size = 20
-            half_count = False
+        half_count = bool(self.half_count_var.get())
+        return filename, chunk_size, half_count
+
+    def _max_len(self):
         try:
-            chunks = self.load_messages_from_file(filename, chunk_size=chunk_size, half_count=half_count)
-        except FileNotFoundError:
+            return int(self.max_len_entry.get().strip())
+        except Exception:
+            return MAX_MESSAGE_LEN
+
+    def _show_file_error(self, filename, e):
+        if isinstance(e, FileNotFoundError):
             messagebox.showwarning("文件未找到", f"{filename} 不存在，请检查路径。")
-            return
-        except Exception as e:
+        else:
             messagebox.showerror("读取失败", f"读取文件失败: {e}")
-            return
-        if not chunks:
-            messagebox.showwarning("文件为空", "文件读取后为空（或全部为空白）。")
-            return
-        # 把分割结果预览到弹幕编辑区（每行一条）
-        self.msg_text.delete("1.0", tk.END)
-        for c in chunks:
-            self.msg_text.insert(tk.END, c + "\n")
-        self.sender._log(f"已从 {filename} 加载并预览 {len(chunks)} 条消息（每条 {chunk_size} 计数单位，英文/数字算0.5={half_count}）")
-        messagebox.showinfo("预览已生成", f"已生成 {len(chunks)} 条消息并显示在弹幕编辑区。")
+
+    def load_and_preview_file(self):
+        """
+        在单独的预览窗口中分页显示分割结果：分块索引在工作线程中取得（已缓存时几乎不耗时），
+        窗口只读取可见的分块，不把分块写入弹幕编辑区，也就不会被保存进 config.json。
+        """
+        filename, chunk_size, half_count = self._file_settings()
+        if self.preview is None or not self.preview.is_open:
+            self.preview = ChunkPreview(self.root)
+        preview = self.preview
+        preview.loading(filename)
+
+        def show(index):
+            self.preview_btn.config(state=tk.NORMAL)
+            if not preview.is_open:
+                return
+            if not len(index):
+                preview.close()
+                messagebox.showwarning("文件为空", "文件读取后为空（或全部为空白）。")
+                return
+            preview.show(index, filename)
+            self.sender._log(f"已从 {filename} 加载并预览 {len(index)} 条消息（每条 {chunk_size} 计数单位，英文/数字算0.5={half_count}）")
+
+        def failed(e):
+            self.preview_btn.config(state=tk.NORMAL)
+            if preview.is_open:
+                preview.close()
+            self._show_file_error(filename, e)
+        self.preview_btn.config(state=tk.DISABLED)
+        self.workers.run(self.chunk_cache.get_or_build, filename, chunk_size, half_count, on_done=show, on_error=failed)
 
     # ---------------- UI 操作 ----------------
     def validate_cookie(self):
@@ -378,13 +2655,19 @@ class App:
         has_bj = bool(self.sender.bili_jct)
         has_sess = bool(self.sender.sessdata)
         self.sender._log(f"已解析 Cookie：包含 bili_jct={has_bj} SESSDATA={has_sess} （请确认）")
-        ok, msg, raw = self.sender.validate_cookie_login()
-        if ok:
-            messagebox.showinfo("验证通过", f"Cookie 验证成功：{msg}")
-            self.sender._log(f"验证通过: {msg}")
-        else:
-            messagebox.showerror("验证失败", f"Cookie 验证失败：{msg}\n详细返回已写入日志。")
-            self.sender._log(f"验证失败: {msg} 原始: {json.dumps(raw, ensure_ascii=False) if isinstance(raw, dict) else str(raw)[:1000]}")
+
+        def done(result):
+            ok, msg, raw = result
+            self.validate_btn.config(state=tk.NORMAL)
+            if ok:
+                messagebox.showinfo("验证通过", f"Cookie 验证成功：{msg}")
+                self.sender._log(f"验证通过: {msg}")
+            else:
+                messagebox.showerror("验证失败", f"Cookie 验证失败：{msg}\n详细返回已写入日志。")
+                self.sender._log(f"验证失败: {msg} 原始: {json.dumps(raw, ensure_ascii=False) if isinstance(raw, dict) else str(raw)[:1000]}")
+        # 手动验证总是重新请求；请求在后台进行，结果回到主线程显示
+        self.validate_btn.config(state=tk.DISABLED)
+        self.sender.validate_cookie_async(lambda result: self.bus.call(done, result), force=True)
 
     def test_send_once(self):
         roomid = self.room_entry.get().strip()
@@ -392,100 +2675,208 @@ class App:
             messagebox.showwarning("提示", "请输入房间ID。")
             return
 
-        # 若选择使用文件模式，优先尝试从文件获取第一条
-        if self.use_file_var.get():
-            filename = self.file_entry.get().strip() or "message.txt"
-            try:
-                chunk_size = int(self.chunk_entry.get().strip() or 20)
-            except Exception:
-                chunk_size = 20
-            half_count = bool(self.half_count_var.get())
-            try:
-                chunks = self.load_messages_from_file(filename, chunk_size=chunk_size, half_count=half_count)
-            except FileNotFoundError:
-                messagebox.showwarning("文件未找到", f"{filename} 不存在，请检查路径。")
-                return
-            except Exception as e:
-                messagebox.showerror("读取失败", f"读取文件失败: {e}")
-                return
-            if not chunks:
-                messagebox.showwarning("文件为空", "文件读取后为空（或全部为空白）。")
-                return
-            first_msg = chunks[0]
-            messages = [first_msg]
-        else:
-            messages = self.msg_text.get("1.0", tk.END).strip().splitlines()
-
-        if not messages:
-            messagebox.showwarning("提示", "请在弹幕列表中至少填写一条弹幕或启用文件模式并确保文件非空。")
-            return
-
         cookie_str = self.cookie_text.get("1.0", tk.END).strip()
         if cookie_str:
             self.sender.update_cookie(cookie_str)
 
-        def job():
-            self.sender._log("单次发送开始...")
-            res = self.sender.send_single(roomid, messages[0])
+        def done(fut):
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {"ok": False, "error": str(e)}
             if res.get("ok"):
                 self.sender._log("单次发送成功。")
                 messagebox.showinfo("结果", "单次发送成功（响应 code=0）。")
             else:
                 self.sender._log("单次发送失败: " + str(res))
                 messagebox.showerror("结果", f"单次发送失败，请查看日志（或检查 cookie / bili_jct / referer）。\n详情见日志。")
-        threading.Thread(target=job, daemon=True).start()
 
-    def start_auto(self):
-        roomid = self.room_entry.get().strip()
-        if not roomid:
-            messagebox.showwarning("提示", "请输入房间ID。")
+        def send(message):
+            # 单独的检查器，只共用拒绝缓存：不改动自动发送正在用的长度上限，也不计入它的跳过统计
+            preflight = Preflight(self._max_len(), bool(self.half_count_var.get()), rejected=self.sender.preflight.rejected)
+            reason = preflight.check(message, duplicates=False)
+            if reason is not None:
+                self.sender._log(f"单次发送未通过发送前检查（{Preflight.REASONS[reason]}）: {message}", level=WARNING)
+                messagebox.showwarning("未发送", f"该弹幕未通过发送前检查（{Preflight.REASONS[reason]}），没有发出请求。")
+                return
+            # 与自动发送共用同一个发送队列，不会与其并发发送；结果回到主线程显示
+            self.sender._log("单次发送开始...")
+            self.sender.send_queue.submit(roomid, message).add_done_callback(lambda fut: self.bus.call(done, fut))
+
+        # 若选择使用文件模式，优先尝试从文件获取第一条（在工作线程中读取）
+        if self.use_file_var.get():
+            filename, chunk_size, half_count = self._file_settings()
+
+            def got_first(first_msg):
+                if first_msg is None:
+                    messagebox.showwarning("文件为空", "文件读取后为空（或全部为空白）。")
+                    return
+                send(first_msg)
+            source = FileMessageSource(filename, chunk_size=chunk_size, half_count=half_count, cache=self.chunk_cache)
+            self.workers.run(source.first, on_done=got_first, on_error=lambda e: self._show_file_error(filename, e))
             return
 
-        # 决定消息来源：文件模式优先
+        messages = self.msg_text.get("1.0", tk.END).strip().splitlines()
+        if not messages:
+            messagebox.showwarning("提示", "请在弹幕列表中至少填写一条弹幕或启用文件模式并确保文件非空。")
+            return
+        send(messages[0])
+
+    def simulate_run(self):
+        """按当前设置模拟一轮发送（虚拟时钟，不发请求），在日志和弹窗中给出预计时长等统计"""
+        try:
+            interval = float(self.interval_entry.get().strip())
+        except Exception:
+            interval = 2.0
+        randomize = bool(self.random_var.get())
+        max_len = self._max_len()
+        half_count = bool(self.half_count_var.get())
         if self.use_file_var.get():
-            filename = self.file_entry.get().strip() or "message.txt"
-            try:
-                chunk_size = int(self.chunk_entry.get().strip() or 20)
-            except Exception:
-                chunk_size = 20
-            half_count = bool(self.half_count_var.get())
-            try:
-                messages = self.load_messages_from_file(filename, chunk_size=chunk_size, half_count=half_count)
-            except FileNotFoundError:
-                messagebox.showwarning("文件未找到", f"{filename} 不存在，请检查路径。")
-                return
-            except Exception as e:
-                messagebox.showerror("读取失败", f"读取文件失败: {e}")
-                return
-            if not messages:
-                messagebox.showwarning("文件为空", "文件读取后为空（或全部为空白）。")
-                return
-            self.sender._log(f"从文件 {filename} 加载到 {len(messages)} 条消息（分割长度={chunk_size}, 英文/数字半字={half_count}）并开始发送。")
+            filename, chunk_size, _ = self._file_settings()
+            source = FileMessageSource(filename, chunk_size=chunk_size, half_count=half_count, cache=self.chunk_cache)
+            load = source.as_sequence
         else:
+            filename = None
             messages = [line.strip() for line in self.msg_text.get("1.0", tk.END).splitlines() if line.strip()]
             if not messages:
-                messagebox.showwarning("提示", "弹幕列表为空，请至少填写一条弹幕或启用文件模式并确保文件非空。")
+                messagebox.showwarning("提示", "弹幕列表为空，请至少填写一条弹幕或启用文件模式。")
                 return
+            load = lambda: messages
+
+        def job():
+            return dry_run(load(), interval=interval, randomize=randomize, max_len=max_len, half_count=half_count)
+
+        def show(report):
+            self.dry_run_btn.config(state=tk.NORMAL)
+            text = format_dry_run(report)
+            self.sender._log(text)
+            messagebox.showinfo("模拟运行结果", text)
+
+        def failed(e):
+            self.dry_run_btn.config(state=tk.NORMAL)
+            if filename is not None:
+                self._show_file_error(filename, e)
+            else:
+                messagebox.showerror("模拟运行失败", str(e))
+        self.dry_run_btn.config(state=tk.DISABLED)
+        self.workers.run(job, on_done=show, on_error=failed)
+
+    def start_auto(self):
+        roomid = self.room_entry.get().strip()
+        if not roomid:
+            messagebox.showwarning("提示", "请输入房间ID。")
+            return
 
         cookie_str = self.cookie_text.get("1.0", tk.END).strip()
         if cookie_str:
             self.sender.update_cookie(cookie_str)
-        ok, msg, raw = self.sender.validate_cookie_login()
-        if not ok:
-            if not messagebox.askyesno("cookie 未通过验证", f"Cookie 验证未通过：{msg}\n仍要继续发送吗？(不建议继续)"):
-                return
         try:
             interval = float(self.interval_entry.get().strip())
         except Exception:
             interval = 2.0
         randomize = bool(self.random_var.get())
-        self.sender.start_auto(roomid, messages, interval=interval, randomize=randomize)
+        try:
+            max_limited = int(self.max_limited_entry.get().strip())
+        except Exception:
+            max_limited = BACKOFF_MAX_CONSECUTIVE
+        max_len = self._max_len()
+        half_count = bool(self.half_count_var.get())
+        resume = bool(self.resume_var.get())
+        follow = bool(self.follow_var.get())
+
+        def launch(messages):
+            def proceed(result):
+                ok, msg, raw = result
+                self.start_btn.config(state=tk.NORMAL)
+                if not ok:
+                    if not messagebox.askyesno("cookie 未通过验证", f"Cookie 验证未通过：{msg}\n仍要继续发送吗？(不建议继续)"):
+                        return
+                self.sender.start_auto(roomid, messages, interval=interval, randomize=randomize, max_limited=max_limited,
+                                       max_len=max_len, half_count=half_count, resume=resume)
+            # 最近验证通过的 Cookie 直接开始；否则在后台验证，完成后回到主线程继续
+            self.sender.validate_cookie_async(lambda result: self.bus.call(proceed, result))
+
+        # 决定消息来源：文件模式优先
+        if self.use_file_var.get():
+            filename, chunk_size, half_count = self._file_settings()
+            source = FileMessageSource(filename, chunk_size=chunk_size, half_count=half_count, cache=self.chunk_cache)
+
+            def got_first(first_msg):
+                if first_msg is None and not follow:
+                    self.start_btn.config(state=tk.NORMAL)
+                    messagebox.showwarning("文件为空", "文件读取后为空（或全部为空白）。")
+                    return
+                self.sender._log(f"从文件 {filename} 流式读取消息（分割长度={chunk_size}, 英文/数字半字={half_count}）并开始发送。")
+                if max_len and normalize_chunk_size(chunk_size) > max_len:
+                    self.sender._log(f"注意：分割长度 {chunk_size} 大于长度上限 {max_len}，超长的分块会被跳过。", level=WARNING)
+                if follow:
+                    self.sender._log("跟随模式：发完现有内容后继续等待文件追加，只读取新增部分。")
+                    launch(FollowingFileSource(filename, chunk_size=chunk_size, half_count=half_count))
+                else:
+                    launch(source)
+
+            def failed(e):
+                self.start_btn.config(state=tk.NORMAL)
+                self._show_file_error(filename, e)
+            self.start_btn.config(state=tk.DISABLED)
+            self.workers.run(source.first, on_done=got_first, on_error=failed)
+        else:
+            messages = [line.strip() for line in self.msg_text.get("1.0", tk.END).splitlines() if line.strip()]
+            if not messages:
+                messagebox.showwarning("提示", "弹幕列表为空，请至少填写一条弹幕或启用文件模式并确保文件非空。")
+                return
+            self.start_btn.config(state=tk.DISABLED)
+            launch(messages)
 
     def stop_auto(self):
-        self.sender.stop_auto()
+        # 只发出停止信号，线程退出后通过 "stopped" 事件通知界面
+        self.sender.stop_auto(wait=False)
+
+    def _toggle_profile(self):
+        """开启时包装发送热点路径并定期写快照到 profile/；关闭时写最后一份快照并还原"""
+        if self.profile_var.get():
+            if not self.profiler.enabled:
+                self.profiler.start(self.sender)
+                self.sender._log(f"性能分析已开启，每 {self.profiler.interval:.0f} 秒写一份快照到 {self.profiler.out_dir}/")
+        elif self.profiler.enabled:
+            # 最后一份快照要做 tracemalloc 统计，放到工作线程中
+            self.workers.run(self.profiler.stop, on_done=lambda _: self.sender._log(f"性能分析已关闭，快照位于 {self.profiler.out_dir}/"))
+
+    def _on_sender_stopped(self):
+        self._update_status()
+
+    def _drain_log(self):
+        """处理事件总线上的回调，再取出积累的全部日志，整批追加后只重绘一次"""
+        self.bus.drain(on_error=lambda e: self.sender._log(f"界面回调异常: {e}", level=ERROR))
+        items = []
+        try:
+            while True:
+                items.append(self._log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if items:
+            self.log.append_many(items)
+        self.root.after(LOG_DRAIN_MS, self._drain_log)
+
+    def _refresh_status(self):
+        self._update_status()
+        self.root.after(STATUS_REFRESH_MS, self._refresh_status)
+
+    def _update_status(self):
+        text = self.sender.telemetry.status_text()
+        gaps = self.sender.pacer.stats()
+        if gaps["count"]:
+            text += f"  实测间隔 min={gaps['min']} avg={gaps['mean']}s（设定 {gaps['interval']}s）"
+        backoff = self.sender.backoff.status_text()
+        if backoff:
+            text += "  " + backoff
+        preflight = self.sender.preflight.status_text()
+        if preflight:
+            text += "  " + preflight
+        self.status_var.set(text)
 
     def clear_log(self):
-        self.log.delete("1.0", tk.END)
+        self.log.clear()
 
     def clear_cookie(self):
         self.cookie_text.delete("1.0", tk.END)
@@ -498,6 +2889,10 @@ class App:
             chunk_size = int(self.chunk_entry.get().strip() or 20)
         except Exception:
             chunk_size = 20
+        try:
+            max_limited = int(self.max_limited_entry.get().strip())
+        except Exception:
+            max_limited = BACKOFF_MAX_CONSECUTIVE
         cfg = {
             "roomid": self.room_entry.get().strip(),
             "interval": float(self.interval_entry.get().strip() or 2.0),
@@ -507,11 +2902,20 @@ class App:
             "use_file": bool(self.use_file_var.get()),
             "file": self.file_entry.get().strip() or "message.txt",
             "chunk_size": int(chunk_size),
-            "half_count": bool(self.half_count_var.get())
+            "half_count": bool(self.half_count_var.get()),
+            "max_limited": max_limited,
+            "max_len": self._max_len(),
+            "resume": bool(self.resume_var.get()),
+            "follow": bool(self.follow_var.get()),
+            "profile": bool(self.profile_var.get()),
         }
+        if not cfg["messages"] and self._unloaded_messages_ref:
+            # 外置的弹幕列表还在读取或读取失败，编辑区是空的：保留原来的列表文件，不能当成清空
+            del cfg["messages"]
+            cfg["messages_ref"] = self._unloaded_messages_ref
+            self.sender._log(f"弹幕列表尚未载入编辑区，保留原来的 {cfg['messages_ref'].get('file')}。", level=WARNING)
         try:
-            with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-                json.dump(cfg, f, ensure_ascii=False, indent=2)
+            ConfigStore(CONFIG_PATH).save(cfg)
             self.sender._log(f"配置已保存到 {CONFIG_PATH}")
             messagebox.showinfo("保存成功", f"配置已保存到 {CONFIG_PATH}")
         except Exception as e:
@@ -519,18 +2923,39 @@ class App:
             self.sender._log("保存配置失败: " + str(e))
 
     def load_config(self, auto_loaded=False):
-        if not os.path.exists(CONFIG_PATH):
+        store = ConfigStore(CONFIG_PATH)
+        if not store.exists():
             if not auto_loaded:
                 messagebox.showwarning("未找到配置", f"{CONFIG_PATH} 不存在")
             return
+
+        def failed(e):
+            messagebox.showerror("加载失败", str(e))
+            self.sender._log("加载配置失败: " + str(e))
+
+        def read():
+            t0 = time.perf_counter()
+            return store.load(), (time.perf_counter() - t0) * 1000
+        # 读取和解析在工作线程中进行，结果回到主线程填入控件；外置的弹幕列表随后再读
+        self.workers.run(read, on_done=lambda r: self._apply_config(r[0], auto_loaded, store, r[1]), on_error=failed)
+
+    def _fill_messages(self, messages):
+        self._unloaded_messages_ref = None
+        self.msg_text.delete("1.0", tk.END)
+        self.msg_text.insert(tk.END, "\n".join(messages))
+
+    def _apply_config(self, cfg, auto_loaded=False, store=None, load_ms=None):
         try:
-            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-                cfg = json.load(f)
             self.room_entry.delete(0, tk.END); self.room_entry.insert(0, cfg.get("roomid", ""))
             self.interval_entry.delete(0, tk.END); self.interval_entry.insert(0, str(cfg.get("interval", 2.0)))
             self.random_var.set(1 if cfg.get("randomize", False) else 0)
-            self.msg_text.delete("1.0", tk.END)
-            self.msg_text.insert(tk.END, "\n".join(cfg.get("messages", [])))
+            if cfg.get("messages_ref") and store is not None:
+                ref = self._unloaded_messages_ref = cfg["messages_ref"]
+                self.msg_text.delete("1.0", tk.END)
+                self.workers.run(store.load_messages, cfg, on_done=self._fill_messages,
+                                 on_error=lambda e: self.sender._log(f"读取弹幕列表 {ref.get('file')} 失败: {e}", level=ERROR))
+            else:
+                self._fill_messages(cfg.get("messages", []))
             cookie_value = cfg.get("cookie", "")
             self.cookie_text.delete("1.0", tk.END)
             self.cookie_text.insert(tk.END, cookie_value)
@@ -545,10 +2970,19 @@ class App:
             self.chunk_entry.insert(0, str(chunk_size))
             half_flag = bool(cfg.get("half_count", False))
             self.half_count_var.set(1 if half_flag else 0)
+            self.max_limited_entry.delete(0, tk.END)
+            self.max_limited_entry.insert(0, str(cfg.get("max_limited", BACKOFF_MAX_CONSECUTIVE)))
+            self.resume_var.set(1 if cfg.get("resume", True) else 0)
+            self.follow_var.set(1 if cfg.get("follow", False) else 0)
+            self.profile_var.set(1 if cfg.get("profile", False) else 0)
+            self._toggle_profile()
+            self.max_len_entry.delete(0, tk.END)
+            self.max_len_entry.insert(0, str(cfg.get("max_len", MAX_MESSAGE_LEN)))
             # 同步到 session（但不自动验证）
             if cookie_value:
                 self.sender.update_cookie(cookie_value)
-            self.sender._log(f"已从 {CONFIG_PATH} 加载配置（auto_loaded={auto_loaded}）。请点击 验证 Cookie 以确认登录状态。")
+            took = f"，读取耗时 {load_ms:.2f} ms" if load_ms is not None else ""
+            self.sender._log(f"已从 {CONFIG_PATH} 加载配置（auto_loaded={auto_loaded}{took}）。请点击 验证 Cookie 以确认登录状态。")
             if not auto_loaded:
                 messagebox.showinfo("加载成功", f"配置已从 {CONFIG_PATH} 加载（请点击 验证 Cookie 按钮来验证登录）。")
         except Exception as e:
@@ -556,20 +2990,213 @@ class App:
             self.sender._log("加载配置失败: " + str(e))
 
     def delete_config(self):
-        if not os.path.exists(CONFIG_PATH):
+        store = ConfigStore(CONFIG_PATH)
+        if not store.exists():
             messagebox.showinfo("删除配置", "当前没有保存的配置文件。")
             return
         if not messagebox.askyesno("确认删除", f"确定要删除 {CONFIG_PATH} 吗？"):
             return
         try:
-            os.remove(CONFIG_PATH)
+            store.delete()
             self.sender._log(f"已删除 {CONFIG_PATH}")
             messagebox.showinfo("删除成功", f"{CONFIG_PATH} 已删除。")
         except Exception as e:
             messagebox.showerror("删除失败", str(e))
             self.sender._log("删除配置失败: " + str(e))
 
-if __name__ == "__main__":
+# ----------------- 入口 -----------------
+def set_api_base(base):
+    """把登录验证、发送和预连接地址都指向 base（例如 mock_bili_server.py 启动的本地服务器）"""
+    global NAV_URL, SEND_URL, PRECONNECT_URL
+    base = base.rstrip("/")
+    NAV_URL = base + "/x/web-interface/nav"
+    SEND_URL = base + "/msg/send"
+    PRECONNECT_URL = base + "/"
+
+def startup_ms():
+    return (time.perf_counter() - _T0) * 1000
+
+def parse_args(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="B 站直播弹幕自动发送。默认打开图形界面，--headless 时直接按 config.json 和命令行参数发送。")
+    ap.add_argument("--headless", action="store_true", help="无界面模式（不导入 tkinter）")
+    ap.add_argument("--config", default=CONFIG_PATH, help="配置文件路径（默认 config.json）")
+    ap.add_argument("--api-base", default=os.environ.get("BILI_API_BASE"),
+                    help="把所有 API 请求发到该地址（调试用，也可用环境变量 BILI_API_BASE）")
+    ap.add_argument("--room", help="房间ID（覆盖配置）")
+    ap.add_argument("--interval", type=float, help="发送间隔秒数（覆盖配置）")
+    ap.add_argument("--file", help="从该文件读取并分割（启用文件模式）")
+    ap.add_argument("--chunk-size", type=int, help="分割长度")
+    ap.add_argument("--half-count", action="store_true", default=None, help="英文/数字算 0.5")
+    ap.add_argument("--random", action="store_true", default=None, help="随机选取弹幕")
+    ap.add_argument("--max-limited", type=int, help="连续被限流多少次后停止")
+    ap.add_argument("--max-len", type=int, help="单条弹幕长度上限，超出的不发送（默认 0，不限制）")
+    ap.add_argument("--no-resume", action="store_true", help="顺序模式下从第 1 条开始，不从上次位置继续")
+    ap.add_argument("--follow", action="store_true", default=None, help="文件模式下跟随文件追加（类似 tail -f），只读取新增部分")
+    ap.add_argument("--profile", action="store_true", default=None, help=f"开启性能分析，快照写到 {PROFILE_DIR}/")
+    ap.add_argument("--dry-run", nargs="?", const="", metavar="SIZES",
+                    help="只模拟一轮发送并输出预计时长等统计（不发请求、不等待）；文件模式下可给出逗号分隔的多个分割长度对比")
+    ap.add_argument("--history", type=int, nargs="?", const=20, metavar="N", help="列出最近 N 次发送会话后退出")
+    ap.add_argument("--no-validate", action="store_true", help="跳过登录验证")
+    ap.add_argument("--force", action="store_true", help="登录验证失败也继续发送")
+    ap.add_argument("--log-level", default="INFO", choices=[LOG_LEVEL_NAMES[k] for k in sorted(LOG_LEVEL_NAMES)])
+    ap.add_argument("--startup-time", action="store_true", help="只测量并打印冷启动耗时后退出")
+    return ap.parse_args(argv)
+
+def show_history(limit=20, path=HISTORY_DB_PATH):
+    """打印最近的发送会话：时间、房间、弹幕源、尝试/成功次数、最后送达的序号、平均延迟"""
+    rows = SendHistory(path).sessions(limit)
+    if not rows:
+        print(f"{path} 中没有发送记录。")
+        return 0
+    fmt = lambda t: datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S") if t else "-"
+    for r in rows:
+        last = "-" if r["last_ok_index"] is None else r["last_ok_index"] + 1
+        lat = "-" if r["avg_latency_ms"] is None else f"{r['avg_latency_ms']:.0f} ms"
+        print(f"#{r['id']}  {fmt(r['started'])} ~ {fmt(r['ended'])}  房间 {r['roomid']}  {r['source']}  "
+              f"尝试 {r['attempts']} 成功 {r['ok'] or 0}  最后送达第 {last} 条  平均延迟 {lat}")
+    return 0
+
+def run_dry_run(args, sender, messages, interval, randomize, max_len, half_count):
+    """--dry-run：模拟一轮并打印报告；文件模式下每个分割长度各模拟一次，最后给出对比"""
+    try:
+        sizes = [int(x) for x in args.dry_run.split(",") if x.strip()]
+    except ValueError:
+        sender._log(f"--dry-run 的分割长度应为逗号分隔的整数: {args.dry_run}", level=ERROR)
+        return 2
+    if not isinstance(messages, FileMessageSource):
+        if sizes:
+            sender._log("列表模式下忽略 --dry-run 的分割长度。", level=WARNING)
+        print(format_dry_run(dry_run(messages, interval, randomize, max_len, half_count)))
+        return 0
+    results = []
+    for size in sizes or [messages.chunk_size]:
+        source = FileMessageSource(messages.filename, chunk_size=size, half_count=half_count, cache=messages.cache)
+        report = dry_run(source.as_sequence(), interval, randomize, max_len, half_count)
+        print(f"== 分割长度 {source.chunk_size} ==")
+        print(format_dry_run(report))
+        results.append((source.chunk_size, report))
+    if len(results) > 1:
+        print("== 对比 ==")
+        for size, r in results:
+            print(f"分割长度 {size}: {r['source_count']} 条，发送 {r['sent']} 条，"
+                  f"预计 {datetime.timedelta(seconds=round(r['duration_s']))}")
+    return 0
+
+def run_headless(args):
+    """
+    无界面运行：配置来自 --config（可选）和命令行参数，Cookie 也可通过环境变量 BILI_COOKIE 提供。
+    收到 SIGTERM/SIGINT 时发出停止信号，等待发送线程退出后返回。
+    """
+    level = {v: k for k, v in LOG_LEVEL_NAMES.items()}[args.log_level]
+    sender = DanmakuSender(lambda lvl, line: print(line, flush=True), log_level=level)
+    if args.startup_time:
+        print(f"headless 启动耗时 {startup_ms():.1f} ms")
+        return 0
+
+    cfg = {}
+    store = ConfigStore(args.config)
+    if store.exists():
+        try:
+            cfg = store.load()
+        except Exception as e:
+            sender._log(f"读取 {args.config} 失败: {e}", level=ERROR)
+            return 2
+    roomid = str(args.room or cfg.get("roomid", "")).strip()
+    if not roomid and args.dry_run is None:
+        sender._log("错误：未指定房间ID（--room 或 config.json 中的 roomid）。", level=ERROR)
+        return 2
+    interval = args.interval if args.interval is not None else float(cfg.get("interval", 2.0))
+    randomize = args.random if args.random is not None else bool(cfg.get("randomize", False))
+    max_limited = args.max_limited if args.max_limited is not None else int(cfg.get("max_limited", BACKOFF_MAX_CONSECUTIVE))
+    max_len = args.max_len if args.max_len is not None else int(cfg.get("max_len", MAX_MESSAGE_LEN))
+    half_count = args.half_count if args.half_count is not None else bool(cfg.get("half_count", False))
+    resume = not args.no_resume and bool(cfg.get("resume", True))
+    follow = args.follow if args.follow is not None else bool(cfg.get("follow", False))
+    profile = args.profile if args.profile is not None else bool(cfg.get("profile", False))
+    cookie = os.environ.get("BILI_COOKIE") or cfg.get("cookie", "")
+    if cookie:
+        sender.update_cookie(cookie)
+
+    if args.file or cfg.get("use_file"):
+        filename = args.file or cfg.get("file", "message.txt")
+        chunk_size = args.chunk_size if args.chunk_size is not None else cfg.get("chunk_size", 20)
+        messages = FileMessageSource(filename, chunk_size=chunk_size, half_count=half_count, cache=ChunkIndexCache())
+        try:
+            if messages.first() is None and not (follow and args.dry_run is None):
+                sender._log("错误：文件读取后为空（或全部为空白）。", level=ERROR)
+                return 2
+        except Exception as e:
+            sender._log(f"读取文件失败: {e}", level=ERROR)
+            return 2
+        sender._log(f"从文件 {filename} 流式读取消息（分割长度={messages.chunk_size}, 英文/数字半字={half_count}）。")
+        if max_len and messages.chunk_size > max_len:
+            sender._log(f"注意：分割长度 {messages.chunk_size} 大于长度上限 {max_len}，超长的分块会被跳过。", level=WARNING)
+    else:
+        try:
+            messages = [m.strip() for m in store.load_messages(cfg) if m.strip()]
+        except Exception as e:
+            sender._log(f"读取弹幕列表失败: {e}", level=ERROR)
+            return 2
+        if not messages:
+            sender._log("错误：弹幕列表为空（config.json 中的 messages 或 --file）。", level=ERROR)
+            return 2
+
+    if args.dry_run is not None:
+        return run_dry_run(args, sender, messages, interval, randomize, max_len, half_count)
+    if follow and isinstance(messages, FileMessageSource):
+        messages = FollowingFileSource(messages.filename, chunk_size=messages.chunk_size, half_count=half_count)
+        sender._log("跟随模式：发完现有内容后继续等待文件追加，只读取新增部分。")
+
+    if not args.no_validate:
+        ok, msg, raw = sender.validate_cookie_login_cached()
+        sender._log(("验证通过: " if ok else "验证失败: ") + msg, level=INFO if ok else ERROR)
+        if not ok and not args.force:
+            return 3
+
+    def on_signal(signum, frame):
+        sender._log(f"收到信号 {signum}，正在停止...")
+        sender.stop_auto(wait=False)
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, on_signal)
+
+    sender._log(f"headless 启动耗时 {startup_ms():.1f} ms")
+    profiler = Profiler()
+    if profile:
+        profiler.start(sender)
+        sender._log(f"性能分析已开启，每 {profiler.interval:.0f} 秒写一份快照到 {profiler.out_dir}/")
+    sender.start_auto(roomid, messages, interval=interval, randomize=randomize, max_limited=max_limited,
+                      max_len=max_len, half_count=half_count, resume=resume)
+    while sender.thread is not None and sender.thread.is_alive():
+        sender.thread.join(0.5)
+    profiler.stop()
+    return 0
+
+def run_gui(args):
+    global CONFIG_PATH
+    CONFIG_PATH = args.config
+    _load_tk()
     root = tk.Tk()
     app = App(root)
+    app.sender._log(f"界面启动耗时 {startup_ms():.1f} ms")
+    if args.startup_time:
+        print(f"gui 启动耗时 {startup_ms():.1f} ms")
+        root.destroy()
+        return 0
     root.mainloop()
+    app.sender.stop_auto(wait=False)
+    app.profiler.stop()
+    app.workers.shutdown()
+    return 0
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.api_base:
+        set_api_base(args.api_base)
+    if args.history is not None:
+        return show_history(args.history)
+    return run_headless(args) if args.headless else run_gui(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
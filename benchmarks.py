@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+# benchmarks.py
+# 性能基准：python benchmarks.py [--only chunker,send,...] [--compare]
+# 网络相关的基准都打到 mock_bili_server.py 启动的本地服务器，不会访问真实接口。
+# 每次运行的结果追加到 bench_results.jsonl，--compare 与上一次结果对比。
+
+import argparse, datetime, json, os, platform, random, re, shutil, subprocess, sys, tempfile, time
+import auto_sending_with_config as app
+from auto_sending_with_config import Chunker, is_ascii_alnum
+from mock_bili_server import MockBiliServer
+
+RESULTS_PATH = "bench_results.jsonl"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def reference_half_count_chunks(cleaned, chunk_size):
+    """旧版逐字符实现，作为正确性和速度的对照"""
+    chunks = []
+    current = []
+    acc = 0.0
+    for ch in cleaned:
+        w = 0.5 if is_ascii_alnum(ch) else 1.0
+        if acc + w > chunk_size and current:
+            chunks.append("".join(current))
+            current = []
+            acc = 0.0
+        current.append(ch)
+        acc += w
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def make_text(n_chars, seed=0):
+    """生成中英混排、已去除空白的测试文本"""
+    rnd = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789" \
+               "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动，。！？、"
+    return "".join(rnd.choice(alphabet) for _ in range(n_chars))
+
+def chunk_batched(text, chunk_size, half_count, block_chars=64 * 1024):
+    chunker = Chunker(chunk_size, half_count)
+    out = []
+    for i in range(0, len(text), block_chars):
+        out.extend(chunker.feed(text[i:i+block_chars]))
+    out.extend(chunker.flush())
+    return out
+
+def _best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+def _pct(values, p):
+    data = sorted(values)
+    return data[min(len(data) - 1, int(len(data) * p / 100))] if data else None
+
+def _sender(base_url):
+    app.set_api_base(base_url)
+    sender = app.DanmakuSender()
+    sender.telemetry.path = None  # 基准不写日志文件、遥测文件和发送历史
+    sender.history.path = None
+    sender.log_to_file = False
+    sender.update_cookie("SESSDATA=bench; bili_jct=bench")
+    return sender
+
+# ----------------- 正确性校验 -----------------
+VERIFY_ALPHABET = ("abcXYZ0189" "的一是中文，。！？" "-_#@~" "é" "😀🎉𠀀𝒜")  # 含非 BMP 字符（一个字符、多个 utf-8 字节）
+
+def verify_chunker(rounds=500, seed=0):
+    """
+    随机对照 Chunker 与逐字符参考实现：多种分割长度、1–30 字符的随机喂入边界、含非 BMP 字符的文本，
+    half_count 开/关都要逐块一致；再用含空白的临时文件核对 iter_file_chunks。返回校验过的组合数。
+    """
+    rnd = random.Random(seed)
+    checked = 0
+    for _ in range(rounds):
+        text = "".join(rnd.choice(VERIFY_ALPHABET) for _ in range(rnd.randrange(0, 400)))
+        size = rnd.choice([1, 2, 3, 5, 7, 10, 19, 20, 33])
+        for half in (False, True):
+            expected = reference_half_count_chunks(text, size) if half else \
+                [text[i:i+size] for i in range(0, len(text), size)]
+            chunker = Chunker(size, half)
+            got = []
+            i = 0
+            while i < len(text):
+                step = rnd.randint(1, 30)
+                got.extend(chunker.feed(text[i:i+step]))
+                i += step
+            got.extend(chunker.flush())
+            if got != expected:
+                raise AssertionError(f"Chunker 与参考实现不一致: size={size} half={half} text={text!r}")
+            checked += 1
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    try:
+        for _ in range(50):
+            text = "".join(rnd.choice(VERIFY_ALPHABET + " \n\t") for _ in range(rnd.randrange(0, 2000)))
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            cleaned = re.sub(r"\s+", "", text)
+            size = rnd.choice([1, 4, 20])
+            got = list(app.iter_file_chunks(path, size, True, block_chars=rnd.randint(1, 30)))
+            if got != reference_half_count_chunks(cleaned, size):
+                raise AssertionError(f"iter_file_chunks 与参考实现不一致: size={size} text={text!r}")
+            checked += 1
+    finally:
+        os.remove(path)
+    return checked
+
+def _wait(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.01)
+
+def _expect(got, expected, what):
+    if got != expected:
+        raise AssertionError(f"{what}: 期望 {expected!r}，实际 {got!r}")
+
+def verify_resume():
+    """
+    续传：第一次会话发出 a、b 后第 3 条被限流而停止，重启后应从 c 开始；
+    跟随模式 abcdef（每块 4 字）发出 abcd、ef 后停止，追加 ghijklmn 再重启，应接着发 ghij、klmn。
+    """
+    tmpdir = tempfile.mkdtemp()
+    history_path = os.path.join(tmpdir, "history.sqlite3")
+
+    def run(srv, messages, n_sends, max_limited=5):
+        sender = _sender(srv.base_url)
+        sender.history.path = history_path
+        sender.pacer.jitter = 0.0
+        sender.start_auto(1, messages, interval=0.02, max_limited=max_limited)
+        _wait(lambda: len(srv.sends) >= n_sends or not sender.running.is_set())
+        sender.stop_auto()
+        sender.history.close()
+        return [s[1] for s in srv.sends]
+    try:
+        with MockBiliServer(outcomes=("0", "0", "429"), retry_after="0") as srv:
+            _expect(run(srv, list("abcde"), 3, max_limited=1), ["a", "b", "c"], "第一次会话")
+        with MockBiliServer() as srv:
+            _expect(run(srv, list("abcde"), 3)[:3], ["c", "d", "e"], "续传后的发送")
+
+        path = os.path.join(tmpdir, "follow.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("abcdef")
+        with MockBiliServer() as srv:
+            _expect(run(srv, app.FollowingFileSource(path, 4, poll_interval=0.02, idle_flush=0.1), 2),
+                    ["abcd", "ef"], "跟随模式第一次会话")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("ghijklmn")
+        with MockBiliServer() as srv:
+            _expect(run(srv, app.FollowingFileSource(path, 4, poll_interval=0.02, idle_flush=0.1), 2),
+                    ["ghij", "klmn"], "跟随模式续传后的发送")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def verify_limited_stop(max_limited=3):
+    """连续被限流 max_limited 次后停止：之后不再发请求，重发的始终是被限流的那一条"""
+    with MockBiliServer(outcomes=("0",) + ("429",) * 10, retry_after="0.01") as srv:
+        sender = _sender(srv.base_url)
+        sender.pacer.jitter = 0.0
+        sender.start_auto(1, ["a", "b", "c"], interval=0.02, max_limited=max_limited)
+        sender.thread.join(timeout=5)
+        if sender.thread.is_alive():
+            sender.stop_auto()
+            raise AssertionError("连续被限流后没有停止")
+        time.sleep(0.1)
+        _expect([s[1] for s in srv.sends], ["a"] + ["b"] * max_limited, "发出的请求")
+
+def verify_config():
+    """
+    ConfigStore：外置的弹幕列表文件损坏后再次保存会重写；只带 messages_ref 保存（编辑区尚未载入列表）
+    保留原来的列表文件；真正清空列表时删除它。
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = app.ConfigStore(os.path.join(tmpdir, "config.json"), inline_max_bytes=10)
+        messages = [f"弹幕{i}" for i in range(100)]
+        store.save({"roomid": "1", "messages": messages})
+        ref = store.load()["messages_ref"]
+        ref_path = os.path.join(tmpdir, ref["file"])
+        with open(ref_path, "w", encoding="utf-8") as f:
+            f.write("损坏")
+        store.save({"roomid": "1", "messages": messages})
+        _expect(store.load_messages(store.load()), messages, "重写损坏的列表文件后读回")
+
+        store.save({"roomid": "2", "messages_ref": ref})
+        cfg = store.load()
+        _expect((cfg["roomid"], cfg["messages_ref"]), ("2", ref), "保留引用保存后的配置")
+        _expect(store.load_messages(cfg), messages, "保留引用保存后读回")
+
+        store.save({"roomid": "2", "messages": []})
+        _expect(os.path.exists(ref_path), False, "清空列表后旧列表文件仍存在")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def verify_follow_resets():
+    """跟随模式：文件被截断、替换或原地改写后都应从头读取，而不是接着旧的偏移读"""
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "follow.txt")
+
+    def write(text, mode="w"):
+        with open(path, mode, encoding="utf-8") as f:
+            f.write(text)
+
+    def drain(src):
+        out = []
+        while True:
+            chunks = src.poll()
+            if chunks is None:
+                return out
+            out.extend(chunks)
+    try:
+        write("aaaabbbb")
+        src = app.FollowingFileSource(path, 4, idle_flush=float("inf"))
+        _expect(drain(src), ["aaaa", "bbbb"], "首次读取")
+
+        write("cccc")
+        _expect((drain(src), src.resets), (["cccc"], 1), "截断后")
+
+        tmp = path + ".new"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("dddd")
+        os.replace(tmp, path)
+        _expect((drain(src), src.resets), (["dddd"], 2), "替换后")
+
+        # 大小不变的原地改写：显式推后修改时间，避免文件系统时间精度不够时看不出变化
+        with open(path, "r+", encoding="utf-8") as f:
+            f.write("eeee")
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        _expect((drain(src), src.resets), (["eeee"], 3), "原地改写后")
+
+        write("ffff", "a")
+        _expect((drain(src), src.resets), (["ffff"], 3), "之后的追加")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+VERIFIERS = {
+    "续传": verify_resume,
+    "限流停止": verify_limited_stop,
+    "配置保存": verify_config,
+    "跟随模式重置": verify_follow_resets,
+}
+
+# ----------------- 各项基准 -----------------
+def bench_chunker(n_chars=2_000_000, chunk_size=20, repeat=3):
+    """分割吞吐：half_count 批量实现对比逐字符实现（先校验结果一致），以及流式读文件的端到端速度"""
+    text = make_text(n_chars)
+    expected = reference_half_count_chunks(text, chunk_size)
+    if chunk_batched(text, chunk_size, True) != expected:
+        raise AssertionError("批量分割结果与逐字符实现不一致")
+    t_ref = _best_of(lambda: reference_half_count_chunks(text, chunk_size), repeat)
+    t_new = _best_of(lambda: chunk_batched(text, chunk_size, True), repeat)
+    t_plain = _best_of(lambda: chunk_batched(text, chunk_size, False), repeat)
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            # 每 80 字插入换行，模拟真实文本文件
+            f.write("\n".join(text[i:i+80] for i in range(0, len(text), 80)))
+        t_file = _best_of(lambda: sum(1 for _ in app.iter_file_chunks(path, chunk_size, True)), repeat)
+        t0 = time.perf_counter()
+        first = next(app.iter_file_chunks(path, chunk_size, True))
+        t_first = time.perf_counter() - t0
+    finally:
+        os.remove(path)
+    return {
+        "chars": n_chars,
+        "chunks": len(expected),
+        "half_reference_s": round(t_ref, 4),
+        "half_batched_s": round(t_new, 4),
+        "half_speedup": round(t_ref / t_new, 2),
+        "half_mchars_per_s": round(n_chars / t_new / 1e6, 2),
+        "plain_mchars_per_s": round(n_chars / t_plain / 1e6, 2),
+        "file_stream_mchars_per_s": round(n_chars / t_file / 1e6, 2),
+        "file_first_chunk_ms": round(t_first * 1000, 2),
+    }
+
+def bench_send(n=200):
+    """单次发送的客户端开销：模拟服务器零延迟，测 send_single 的往返耗时；并对比冷/预热连接的首条延迟"""
+    with MockBiliServer() as srv:
+        cold = _sender(srv.base_url)
+        t0 = time.perf_counter()
+        cold.send_single(1, "cold")
+        first_cold = time.perf_counter() - t0
+        if cold.telemetry.last_record["new_conn"] is not True:
+            raise AssertionError(f"冷启动的首条发送应记为新建连接: {cold.telemetry.last_record}")
+
+        warm = _sender(srv.base_url)
+        warm.warm_up()
+        t0 = time.perf_counter()
+        warm.send_single(1, "warm")
+        first_warm = time.perf_counter() - t0
+        if warm.telemetry.last_record["new_conn"] is not False:
+            raise AssertionError(f"预热后的首条发送应复用连接: {warm.telemetry.last_record}")
+
+        lat = []
+        for i in range(n):
+            t0 = time.perf_counter()
+            res = warm.send_single(1, f"msg{i}")
+            lat.append(time.perf_counter() - t0)
+            if not res.get("ok"):
+                raise AssertionError(f"发送失败: {res}")
+    return {
+        "sends": n,
+        "first_send_cold_ms": round(first_cold * 1000, 3),
+        "first_send_warm_ms": round(first_warm * 1000, 3),
+        "mean_ms": round(sum(lat) / n * 1000, 3),
+        "p50_ms": round(_pct(lat, 50) * 1000, 3),
+        "p90_ms": round(_pct(lat, 90) * 1000, 3),
+        "sends_per_s": round(n / sum(lat), 1),
+    }
+
+def bench_logging(n=20000):
+    """日志开销：当前 _log（后台批量写文件）、被过滤的 DEBUG 日志，以及旧的逐行打开-追加-关闭写法"""
+    tmpdir = tempfile.mkdtemp()
+    old_writer = app.LOG_WRITER
+    app.LOG_WRITER = app.LogWriter(os.path.join(tmpdir, "bench_log.txt"), compress=False)
+    try:
+        sender = app.DanmakuSender(log_level=app.INFO)
+        payload = {"code": 0, "message": "", "data": {"x": "y" * 200}}
+        t0 = time.perf_counter()
+        for i in range(n):
+            sender._log(f"第{i}条弹幕发送成功: 测试消息")
+        t_info = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for _ in range(n):
+            sender._log(lambda: f"json={json.dumps(payload, ensure_ascii=False)[:1000]}", level=app.DEBUG)
+        t_debug = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        app.LOG_WRITER.close()
+        t_drain = time.perf_counter() - t0
+
+        legacy_path = os.path.join(tmpdir, "legacy_log.txt")
+        m = min(n, 5000)
+        t0 = time.perf_counter()
+        for i in range(m):
+            with open(legacy_path, "a", encoding="utf-8") as f:
+                f.write(f"{datetime.datetime.now().isoformat()} 第{i}条弹幕发送成功: 测试消息\n")
+        t_legacy = time.perf_counter() - t0
+    finally:
+        app.LOG_WRITER = old_writer
+    return {
+        "lines": n,
+        "log_call_us": round(t_info / n * 1e6, 2),
+        "disabled_debug_call_us": round(t_debug / n * 1e6, 3),
+        "writer_drain_ms": round(t_drain * 1000, 1),
+        "legacy_open_append_close_us": round(t_legacy / m * 1e6, 2),
+    }
+
+def bench_scheduler(n=30, interval=0.1):
+    """节奏精度：完整的自动发送循环打到有延迟抖动的模拟服务器，用服务器端收到请求的时刻计算实际间隔"""
+    with MockBiliServer(latency=0.03, jitter=0.03) as srv:
+        sender = _sender(srv.base_url)
+        sender.pacer.jitter = 0.0
+        sender.start_auto(1, [f"m{i}" for i in range(10)], interval=interval)
+        deadline = time.monotonic() + n * interval * 3 + 5
+        while len(srv.sends) < n + 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        sender.stop_auto()
+        times = [t for t, _, _ in srv.sends[:n + 1]]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    errors = [g - interval for g in gaps]
+    return {
+        "interval_s": interval,
+        "gaps": len(gaps),
+        "mean_gap_s": round(sum(gaps) / len(gaps), 4),
+        "mean_error_ms": round(sum(errors) / len(errors) * 1000, 2),
+        "max_error_ms": round(max(errors) * 1000, 2),
+        "below_interval": sum(1 for e in errors if e < -0.005),
+    }
+
+def bench_backoff(retry_after=0.5, interval=0.05):
+    """限流恢复：服务器第 3 次请求返回 429 + Retry-After，检查暂停时长以及之后能否继续发送"""
+    with MockBiliServer(outcomes=("0", "0", "429", "0", "0", "0"), retry_after=retry_after) as srv:
+        sender = _sender(srv.base_url)
+        sender.pacer.jitter = 0.0
+        sender.start_auto(1, ["a", "b", "c"], interval=interval)
+        deadline = time.monotonic() + retry_after + 5
+        while len(srv.sends) < 6 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        sender.stop_auto()
+        sends = list(srv.sends)
+    limited = [i for i, s in enumerate(sends) if s[2] == "429"]
+    pause = sends[limited[0] + 1][0] - sends[limited[0]][0] if limited and len(sends) > limited[0] + 1 else None
+    return {
+        "retry_after_s": retry_after,
+        "pause_s": round(pause, 3) if pause is not None else None,
+        "retry_after_honored": pause is not None and pause >= retry_after,
+        "resent_same_message": bool(limited) and len(sends) > limited[0] + 1 and sends[limited[0] + 1][1] == sends[limited[0]][1],
+        "sends_after_limit": len(sends) - (limited[0] + 1) if limited else 0,
+    }
+
+def bench_startup(repeat=5):
+    """冷启动：子进程运行 --startup-time；有显示器时同时测图形界面模式"""
+    script = os.path.join(HERE, "auto_sending_with_config.py")
+
+    def measure(extra):
+        values = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, script, "--startup-time"] + extra,
+                                 capture_output=True, text=True, timeout=60)
+            m = re.search(r"([\d.]+) ms", out.stdout)
+            if not m:
+                return None
+            values.append(float(m.group(1)))
+        return round(min(values), 1)
+    res = {"headless_ms": measure(["--headless"])}
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        res["gui_ms"] = measure([])
+    return res
+
+def bench_config(n_messages=20000, repeat=5):
+    """配置读写：旧的内联 indent=2 写法对比 ConfigStore（设置紧凑保存、弹幕列表外置并延迟读取）"""
+    messages = [make_text(20, seed=i) for i in range(n_messages)]
+    cfg = {"roomid": "123456", "interval": 2.0, "randomize": False, "cookie": "SESSDATA=x; bili_jct=y",
+           "use_file": False, "file": "message.txt", "chunk_size": 20, "half_count": False, "messages": messages}
+    tmpdir = tempfile.mkdtemp()
+    legacy = os.path.join(tmpdir, "legacy.json")
+    store = app.ConfigStore(os.path.join(tmpdir, "config.json"))
+
+    def legacy_save():
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump(cfg, f, ensure_ascii=False, indent=2)
+
+    def legacy_load():
+        with open(legacy, "r", encoding="utf-8") as f:
+            return json.load(f)
+    t_legacy_save = _best_of(legacy_save, repeat)
+    t_legacy_load = _best_of(legacy_load, repeat)
+    t_save = _best_of(lambda: store.save(cfg), repeat)
+    t_load = _best_of(store.load, repeat)
+    loaded = store.load()
+    t_messages = _best_of(lambda: store.load_messages(loaded), repeat)
+    if store.load_messages(loaded) != messages:
+        raise AssertionError("外置弹幕列表读回的内容不一致")
+    return {
+        "messages": n_messages,
+        "legacy_bytes": os.path.getsize(legacy),
+        "config_bytes": os.path.getsize(store.path),
+        "legacy_save_ms": round(t_legacy_save * 1000, 2),
+        "save_ms": round(t_save * 1000, 2),
+        "legacy_load_ms": round(t_legacy_load * 1000, 3),
+        "settings_load_ms": round(t_load * 1000, 3),
+        "messages_load_ms": round(t_messages * 1000, 3),
+    }
+
+def bench_follow(n_chars=2_000_000, n_appends=20, append_chars=1000, chunk_size=20):
+    """跟随模式：文件追加后只读新增字节（FollowingFileSource.poll）对比每次重新分割整个文件；另测无变化时一次检查的开销"""
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "message.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(make_text(n_chars))
+    src = app.FollowingFileSource(path, chunk_size=chunk_size, idle_flush=float("inf"))
+
+    def drain():
+        out = []
+        while True:
+            chunks = src.poll()
+            if chunks is None:
+                return out
+            out.extend(chunks)
+    t0 = time.perf_counter()
+    got = drain()
+    t_initial = time.perf_counter() - t0
+    t_idle = _best_of(src.poll, 50)
+    t_append = t_rescan = 0.0
+    for i in range(n_appends):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(make_text(append_chars, seed=i + 1))
+        t0 = time.perf_counter()
+        got.extend(drain())
+        t_append += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        full = list(app.iter_file_chunks(path, chunk_size))
+        t_rescan += time.perf_counter() - t0
+    if got != full[:len(got)] or len(full) - len(got) > 1:
+        raise AssertionError("跟随模式的分块与整体重新分割的结果不一致")
+    return {
+        "file_chars": n_chars,
+        "appends": n_appends,
+        "initial_ms": round(t_initial * 1000, 2),
+        "idle_poll_us": round(t_idle * 1e6, 1),
+        "append_ms": round(t_append / n_appends * 1000, 3),
+        "rescan_ms": round(t_rescan / n_appends * 1000, 2),
+    }
+
+BENCHES = {
+    "chunker": bench_chunker,
+    "send": bench_send,
+    "logging": bench_logging,
+    "scheduler": bench_scheduler,
+    "backoff": bench_backoff,
+    "startup": bench_startup,
+    "config": bench_config,
+    "follow": bench_follow,
+}
+
+# ----------------- 结果保存与对比 -----------------
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=HERE, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def load_previous(path):
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+def print_results(results, previous=None):
+    prev = (previous or {}).get("results", {})
+    for name, res in results.items():
+        print(f"[{name}]")
+        for k, v in res.items():
+            line = f"  {k:>28}: {v}"
+            old = prev.get(name, {}).get(k)
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and isinstance(old, (int, float)) and old:
+                line += f"   (上次 {old}, {(v - old) / abs(old) * 100:+.1f}%)"
+            print(line)
+
+def main():
+    ap = argparse.ArgumentParser(description="弹幕发送器性能基准")
+    ap.add_argument("--only", help="逗号分隔，只运行这些基准：" + ",".join(BENCHES))
+    ap.add_argument("--chars", type=int, default=2_000_000, help="分割基准的文本长度")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--results", default=RESULTS_PATH, help="结果追加写入的 JSONL 文件")
+    ap.add_argument("--no-save", action="store_true", help="不保存本次结果")
+    ap.add_argument("--compare", action="store_true", help="与结果文件中的上一次运行对比")
+    ap.add_argument("--verify", action="store_true", help="只运行正确性校验（随机对照参考实现、模拟服务器上的续传/限流、临时文件上的配置保存和跟随模式），不计时")
+    args = ap.parse_args()
+
+    if args.verify:
+        print(f"Chunker 校验通过：{verify_chunker()} 组")
+        for name, fn in VERIFIERS.items():
+            fn()
+            print(f"{name}校验通过")
+        return
+
+    names = [n.strip() for n in args.only.split(",")] if args.only else list(BENCHES)
+    unknown = [n for n in names if n not in BENCHES]
+    if unknown:
+        ap.error(f"未知的基准: {', '.join(unknown)}")
+    previous = load_previous(args.results) if args.compare else None
+    results = {}
+    for name in names:
+        if name == "chunker":
+            results[name] = bench_chunker(args.chars, repeat=args.repeat)
+        else:
+            results[name] = BENCHES[name]()
+    print_results(results, previous)
+    if not args.no_save:
+        record = {
+            "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+            "rev": git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+if __name__ == "__main__":
+    main()
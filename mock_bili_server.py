@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# mock_bili_server.py
+# 本地模拟 B 站接口，用于离线调试和性能基准：
+#   python mock_bili_server.py --port 8765 --latency 0.05 --outcomes 0,0,429
+#   python auto_sending_with_config.py --api-base http://127.0.0.1:8765
+# 支持 POST /msg/send、GET /x/web-interface/nav，其余路径返回 404（可用于预连接）。
+
+import argparse, json, threading, time, random
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+# /msg/send 的结果，按 outcomes 列表循环使用：
+#   "0"      发送成功
+#   "412"    HTTP 412（HTML 页面，模拟风控拦截）
+#   "429"    HTTP 429（JSON，带 Retry-After 时附上该头）
+#   "10030"  HTTP 200 + code=10030（发送频率过快）
+#   "reject" HTTP 200 + code=0 + message="f"（内容被屏蔽）
+OUTCOMES = ("0", "412", "429", "10030", "reject")
+
+class MockBiliServer:
+    """
+    在后台线程运行的模拟服务器。latency/jitter 为每个请求的处理延迟（秒），
+    outcomes 决定 /msg/send 的返回，retry_after 不为 None 时 412/429 带 Retry-After 头。
+    收到的发送请求记录在 sends 中（单调时钟时刻、消息、结果），便于核对节奏。
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, outcomes=("0",),
+                 retry_after=None, logged_in=True, uname="mock_user"):
+        for o in outcomes:
+            if o not in OUTCOMES:
+                raise ValueError(f"未知的 outcome: {o}（可选 {', '.join(OUTCOMES)}）")
+        self.latency = latency
+        self.jitter = jitter
+        self.outcomes = list(outcomes)
+        self.retry_after = retry_after
+        self.logged_in = logged_in
+        self.uname = uname
+        self.sends = []
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-bili", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _next_outcome(self):
+        with self._lock:
+            outcome = self.outcomes[self._counter % len(self.outcomes)]
+            self._counter += 1
+        return outcome
+
+    def _delay(self):
+        d = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if d > 0:
+            time.sleep(d)
+
+    def _make_handler(server):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 头和正文分两次写出，不关 Nagle 会与客户端的延迟确认叠加出约 40ms 的假延迟
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, content_type="application/json; charset=utf-8", headers=None):
+                data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+
+            def do_HEAD(self):
+                self._reply(404, "")
+
+            def do_GET(self):
+                server._delay()
+                if self.path.split("?")[0] != "/x/web-interface/nav":
+                    self._reply(404, {"code": -404, "message": "啥都木有"})
+                    return
+                if server.logged_in:
+                    self._reply(200, {"code": 0, "message": "0", "data": {"isLogin": True, "uname": server.uname}})
+                else:
+                    self._reply(200, {"code": -101, "message": "账号未登录", "data": {"isLogin": False}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                t = time.monotonic()
+                server._delay()
+                if self.path.split("?")[0] != "/msg/send":
+                    self._reply(404, {"code": -404, "message": "啥都木有"})
+                    return
+                msg = (form.get("msg") or [""])[0]
+                outcome = server._next_outcome()
+                with server._lock:
+                    server.sends.append((t, msg, outcome))
+                extra = {"Retry-After": str(server.retry_after)} if server.retry_after is not None else {}
+                if not (form.get("csrf") or [""])[0]:
+                    self._reply(200, {"code": -111, "message": "csrf 校验失败"})
+                elif outcome == "0":
+                    self._reply(200, {"code": 0, "message": "", "msg": "", "data": {}})
+                elif outcome == "412":
+                    self._reply(412, "<html><body>412 Precondition Failed</body></html>", "text/html", extra)
+                elif outcome == "429":
+                    self._reply(429, {"code": -429, "message": "请求过于频繁"}, headers=extra)
+                elif outcome == "10030":
+                    self._reply(200, {"code": 10030, "message": "您发送弹幕的频率过快", "msg": "您发送弹幕的频率过快"})
+                else:
+                    self._reply(200, {"code": 0, "message": "f", "msg": "f", "data": {}})
+        return Handler
+
+def main():
+    ap = argparse.ArgumentParser(description="本地模拟 B 站弹幕接口")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.0, help="每个请求的处理延迟（秒）")
+    ap.add_argument("--jitter", type=float, default=0.0, help="额外的随机延迟上限（秒）")
+    ap.add_argument("--outcomes", default="0", help="逗号分隔，循环使用：" + ",".join(OUTCOMES))
+    ap.add_argument("--retry-after", help="412/429 响应附带的 Retry-After 值")
+    ap.add_argument("--logged-out", action="store_true", help="/nav 返回未登录")
+    args = ap.parse_args()
+    srv = MockBiliServer(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                         outcomes=[o.strip() for o in args.outcomes.split(",") if o.strip()],
+                         retry_after=args.retry_after, logged_in=not args.logged_out)
+    print(f"模拟服务器已启动: {srv.base_url}（Ctrl+C 退出）")
+    try:
+        srv._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv._httpd.server_close()
+
+if __name__ == "__main__":
+    main()